@@ -4,12 +4,11 @@ import uuid
 import time
 from datetime import datetime
 from dotenv import load_dotenv
-from core.loader import load_pdf
-from core.splitter import split_documents
-from core.vector_store import create_vector_store, load_vector_store
-from core.rag_chain import get_rag_chain_with_memory_and_sources
-from core.history import save_chat, load_chat, list_chats, delete_chat
-from langchain_core.messages import HumanMessage, AIMessage
+from core.ingestion import run_ingestion
+from core.loader import get_vision_cache
+from core.vector_store import get_resource_status, get_embedding_cache
+from core.rag_chain import get_streaming_rag_chain_with_memory_and_sources
+from core.history import save_chat, load_chat, list_chats, count_chats, delete_chat, start_retention_sweeper, get_retention_status, HISTORY_PAGE_SIZE
 
 # --- PAGE SETUP ---
 st.set_page_config(
@@ -139,6 +138,9 @@ st.session_state.last_activity = time.time()
 if "username" not in st.session_state:
     st.session_state.username = "Guest_User"
 
+# Chat retention runs in a background thread (once per process) instead of on every listing
+start_retention_sweeper()
+
 if "chat_id" not in st.session_state:
     st.session_state.chat_id = str(uuid.uuid4())
 
@@ -174,7 +176,18 @@ with st.sidebar:
     
     # Session Info
     st.caption(f"🆔 Session: `{st.session_state.chat_id[:8]}...`")
+    engine_warm = get_resource_status().get("rag_chain", {}).get("warm", False)
+    st.caption(f"⚙️ Engine: {'🟢 warm' if engine_warm else '⚪ cold'}")
+    cache_stats = get_embedding_cache().stats()
+    st.caption(f"🗃️ Embedding cache: {cache_stats['entries']} vectors, {cache_stats['hit_rate']:.0%} hit rate")
+    vision_stats = get_vision_cache().stats()
+    st.caption(f"👁️ Vision cache: {vision_stats['entries']} pages, {vision_stats['hit_rate']:.0%} hit rate")
+    retention = get_retention_status()
+    if retention["runs"]:
+        st.caption(f"🧹 Retention: {retention['total_expired']} chats expired, last sweep {retention['last_duration'] * 1000:.0f} ms")
     
+    show_timings = st.checkbox("Show timing breakdown", value=False)
+
     # New Chat Button
     st.markdown('<div class="new-chat-btn">', unsafe_allow_html=True)
     if st.button("➕ Start New Session", use_container_width=True):
@@ -191,70 +204,84 @@ with st.sidebar:
         st.error("⚠️ Qdrant Cloud not configured. Please set QDRANT_URL and QDRANT_API_KEY in .env")
     
     uploaded_files = st.file_uploader("Upload PDF Documents", accept_multiple_files=True, type=['pdf'])
+    rebuild_kb = st.checkbox("Rebuild knowledge base from scratch", value=False)
+    extraction_backend = st.selectbox(
+        "Text extraction",
+        options=["pymupdf", "unstructured"],
+        format_func=lambda b: "⚡ Fast (PyMuPDF + OCR fallback)" if b == "pymupdf" else "🧩 Unstructured",
+    )
     
     if st.button("🚀 Process the Document", use_container_width=True, disabled=not QDRANT_READY):
         if uploaded_files:
             progress_bar = st.progress(0)
             status_text = st.empty()
             
-            all_docs = []
             temp_dir = "temp_uploads"
             if not os.path.exists(temp_dir):
                 os.makedirs(temp_dir)
-            
-            total_files = len(uploaded_files)
-            for i, uploaded_file in enumerate(uploaded_files):
-                status_text.text(f"📥 Processing: {uploaded_file.name}...")
+
+            files = []
+            for uploaded_file in uploaded_files:
                 file_path = os.path.join(temp_dir, uploaded_file.name)
                 with open(file_path, "wb") as f:
                     f.write(uploaded_file.getbuffer())
-                
-                progress_bar.progress((i + 1) / (total_files * 2)) 
-                
-                try:
-                    # 1. Extract Text (Fast strategy)
-                    status_text.text(f"📥 Extracting Text: {uploaded_file.name}...")
-                    text_docs = load_pdf(file_path)
-                    all_docs.extend(text_docs)
-                    
-                    # 2. Extract Visual Content (Gemini Vision)
-                    from core.loader import process_pdf_images
-                    status_text.text(f"👁️ Analyzing Visuals: {uploaded_file.name}...")
-                    visual_docs = process_pdf_images(file_path, uploaded_file.name)
-                    all_docs.extend(visual_docs)
-                    
-                    # Cleanup local file after loading
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
-                except Exception as e:
-                    st.error(f"Error loading {uploaded_file.name}: {str(e)}")
-                    if os.path.exists(file_path):
-                        os.remove(file_path)
+                files.append((file_path, uploaded_file.name, extraction_backend))
+
+            def on_ingest_event(event, info):
+                if event == "pages_extracted":
+                    status_text.text(f"📄 Extracting text... {info['pages_done']}/{info['pages_total']} pages")
+                elif event == "file_extracted":
+                    status_text.text(f"👁️ Analyzing Visuals: {info['filename']}...")
+                elif event == "file_failed":
+                    st.error(f"Error loading {info['filename']}: {info['error']}")
+                elif event == "chunks_indexed":
+                    status_text.text(f"💾 Syncing with Qdrant Cloud... {info['chunks']} chunks processed")
+                progress_bar.progress(info["progress"])
 
-            status_text.text("⚡ Optimizing & Splitting...")
-            chunks = split_documents(all_docs)
-            progress_bar.progress(0.8)
-            
-            status_text.text("💾 Syncing with Qdrant Cloud...")
             try:
-                create_vector_store(chunks)
+                stats = run_ingestion(files, incremental=not rebuild_kb, progress_callback=on_ingest_event)
+                if not stats["points"] and not stats["skipped"]:
+                    raise ValueError("No content could be extracted from the uploaded files.")
                 st.session_state.process_complete = True
+                st.session_state.last_ingest_report = stats["report"]
                 progress_bar.progress(1.0)
-                status_text.text("✅ Sync Complete!")
+                status_text.text(f"✅ Sync Complete! {stats['points']} new chunks indexed.")
                 time.sleep(1)
                 st.rerun()
             except Exception as e:
                 st.error(f"Cloud Storage Error: {str(e)}")
                 if "quota" in str(e).lower():
                     st.warning("API Quota hit. Please wait a moment or check your Google Cloud Console.")
+            finally:
+                # Cleanup local files after processing
+                for file_path, *_ in files:
+                    if os.path.exists(file_path):
+                        os.remove(file_path)
         else:
             st.error("Please select a file first.")
 
+    report = st.session_state.get("last_ingest_report")
+    if report:
+        with st.expander("📊 Last ingest report"):
+            cost = report["estimated_cost"]
+            st.caption(
+                f"{report['pages']} pages, {report['chunks']} chunks, {report['vectors']} vectors in {report['seconds']:.1f}s "
+                f"({report['pages_per_sec']:.1f} pages/sec) · {report['bytes_uploaded'] / 1e6:.1f} MB uploaded · "
+                f"{report['embedding_calls']} embedding / {report['vision_calls']} vision calls · ~${cost['total_usd']:.4f}"
+            )
+            st.caption(" · ".join(f"{stage} {seconds:.1f}s" for stage, seconds in report["stage_seconds"].items()))
+            st.dataframe(
+                [{k: f[k] for k in ("filename", "status", "pages", "chunks", "extract_seconds", "vision_seconds", "vision_calls")} for f in report["files"]],
+                use_container_width=True,
+            )
+
     st.markdown("---")
     
     # Recent Activity
     st.subheader("Global History")
-    past_chats = list_chats(st.session_state.username)
+    if "history_limit" not in st.session_state:
+        st.session_state.history_limit = HISTORY_PAGE_SIZE
+    past_chats = list_chats(st.session_state.username, limit=st.session_state.history_limit)
     for chat in past_chats:
         col1, col2 = st.columns([0.8, 0.2])
         with col1:
@@ -268,6 +295,10 @@ with st.sidebar:
             if st.button("🗑️", key=f"del_{chat['id']}"):
                 delete_chat(chat['id'])
                 st.rerun()
+    if len(past_chats) == st.session_state.history_limit and count_chats(st.session_state.username) > len(past_chats):
+        if st.button("Show older chats", use_container_width=True):
+            st.session_state.history_limit += HISTORY_PAGE_SIZE
+            st.rerun()
 
 # --- MAIN INTERFACE ---
 st.markdown('<h1 class="main-title">AI Knowledge Assistant</h1>', unsafe_allow_html=True)
@@ -292,43 +323,60 @@ if prompt := st.chat_input("Analyze document content..."):
             st.warning("Knowledge base is empty. Please upload documents in the sidebar to begin analysis.")
     else:
         with st.chat_message("assistant"):
-            with st.spinner("Retrieving from Cloud & Synthesizing..."):
-                try:
-                    # Prepare history
-                    chat_history = []
-                    for msg in st.session_state.messages[:-1]:
-                        if msg["role"] == "user":
-                            chat_history.append(HumanMessage(content=msg["content"]))
-                        else:
-                            chat_history.append(AIMessage(content=msg["content"]))
-
-                    # Chain Call
-                    rag_chain = get_rag_chain_with_memory_and_sources()
-                    result = rag_chain({
+            status_placeholder = st.empty()
+            status_placeholder.caption("🔎 Retrieving from Cloud...")
+            try:
+                # Prepare history (the chain keeps only the recent turns within its token budget)
+                chat_history = st.session_state.messages[:-1]
+
+                # Streaming Chain Call: sources arrive first, then answer tokens
+                stream_chain = get_streaming_rag_chain_with_memory_and_sources()
+                result = {}
+
+                def answer_tokens():
+                    for event in stream_chain({
                         "chat_history": chat_history,
                         "question": prompt
-                    })
-                    
-                    answer = result["answer"]
-                    sources = result["sources"]
-
-                    st.markdown(answer)
-                    
-                    if sources:
-                        sources_html = "".join([f'<span class="source-tag">📍 {s}</span>' for s in sources])
-                        st.markdown(f"**Sources:** {sources_html}", unsafe_allow_html=True)
-
-                    # Persist
-                    st.session_state.messages.append({
-                        "role": "assistant", 
-                        "content": answer,
-                        "sources": sources
-                    })
-                    save_chat(st.session_state.chat_id, st.session_state.messages, st.session_state.username)
-                    
-                except Exception as e:
-                    err_msg = str(e)
-                    if "quota" in err_msg.lower():
-                        st.error("🛑 Embedding API Quota hit. Try again in 60 seconds.")
-                    else:
-                        st.error(f"Generation Error: {err_msg}")
+                    }):
+                        if event["type"] == "sources":
+                            status_placeholder.caption(f"🧠 Synthesizing from {len(event['chunks'])} retrieved chunks...")
+                        elif event["type"] == "token":
+                            yield event["text"]
+                        elif event["type"] == "done":
+                            result.update(event)
+
+                answer = st.write_stream(answer_tokens())
+                sources = result.get("sources", [])
+                status_placeholder.empty()
+
+                if result.get("cached"):
+                    st.caption("⚡ Answered from cache")
+                if show_timings and result.get("timings"):
+                    timings = result["timings"]
+                    stages = " · ".join(f"{stage} {ms:.0f} ms" for stage, ms in timings.items() if stage != "total")
+                    st.caption(f"⏱️ {timings['total']:.0f} ms total — {stages}")
+                budget = result.get("budget")
+                if budget and "context_tokens" in budget:
+                    st.caption(
+                        f"🧮 ~{budget['context_tokens']}/{budget['context_budget']} context tokens · "
+                        f"{budget['history_messages']} recent messages, {budget['summarized_messages']} summarized"
+                    )
+                
+                if sources:
+                    sources_html = "".join([f'<span class="source-tag">📍 {s}</span>' for s in sources])
+                    st.markdown(f"**Sources:** {sources_html}", unsafe_allow_html=True)
+
+                # Persist
+                st.session_state.messages.append({
+                    "role": "assistant", 
+                    "content": result.get("answer", answer),
+                    "sources": sources
+                })
+                save_chat(st.session_state.chat_id, st.session_state.messages, st.session_state.username)
+                
+            except Exception as e:
+                err_msg = str(e)
+                if "quota" in err_msg.lower():
+                    st.error("🛑 Embedding API Quota hit. Try again in 60 seconds.")
+                else:
+                    st.error(f"Generation Error: {err_msg}")
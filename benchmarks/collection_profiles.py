@@ -0,0 +1,192 @@
+"""
+Recall@k versus latency and memory for each Qdrant collection profile
+(core.collection_profiles). Every profile gets its own collection, created through
+core.vector_store.ensure_collection, filled with the same vectors and queried with the
+profile's search params; recall is measured against exact full-dimension cosine search.
+
+Vectors are synthetic by default (clustered, with variance concentrated in the leading
+dimensions like Matryoshka embeddings), or read from an existing collection with
+--from-collection (a held-out slice of it serves as queries).
+
+Run it against a local Qdrant server (docker run -p 6333:6333 qdrant/qdrant) with
+--url http://localhost:6333. Without --url an in-process Qdrant is used: it always
+searches exhaustively and ignores HNSW and quantization settings, so only dimension
+truncation shows up in its numbers.
+
+Usage: python -m benchmarks.collection_profiles [--url http://localhost:6333] [--points 20000]
+       [--dim 3072] [--queries 200] [--k 10] [--profiles default scalar binary] [--json out.json]
+"""
+import time
+import argparse
+import json
+import numpy as np
+
+from benchmarks.pipeline import _percentile
+
+COLLECTION_PREFIX = "profile_bench_"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def make_vectors(points: int, queries: int, dim: int, seed: int = 0, clusters: int = 64):
+    """Clustered unit vectors whose per-dimension spread decays like 1/sqrt(i), plus noisy queries near them."""
+    rng = np.random.default_rng(seed)
+    scale = (1.0 / np.sqrt(np.arange(1, dim + 1))).astype(np.float32)
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32) * scale
+    assignment = rng.integers(0, clusters, points)
+    corpus = centers[assignment] + 0.6 * rng.standard_normal((points, dim), dtype=np.float32) * scale
+    anchors = corpus[rng.integers(0, points, queries)]
+    query_vectors = anchors + 0.4 * rng.standard_normal((queries, dim), dtype=np.float32) * scale
+    return _normalize(corpus), _normalize(query_vectors)
+
+
+def load_collection_vectors(client, collection_name: str, points: int, queries: int, seed: int = 0):
+    """Scrolls up to points + queries stored vectors; a random held-out slice becomes the queries."""
+    vectors = []
+    offset = None
+    while len(vectors) < points + queries:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=min(256, points + queries - len(vectors)),
+            offset=offset,
+            with_payload=False,
+            with_vectors=True,
+        )
+        vectors.extend(record.vector for record in records)
+        if offset is None:
+            break
+    if len(vectors) <= queries:
+        raise ValueError(f"Collection '{collection_name}' has only {len(vectors)} vectors.")
+    vectors = _normalize(np.asarray(vectors, dtype=np.float32))
+    np.random.default_rng(seed).shuffle(vectors)
+    return vectors[queries:], vectors[:queries]
+
+
+def exact_neighbors(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """Top-k ids by exact cosine similarity (the ground truth for recall)."""
+    truth = []
+    for start in range(0, len(queries), 256):
+        scores = queries[start:start + 256] @ corpus.T
+        top = np.argpartition(-scores, k, axis=1)[:, :k]
+        order = np.take_along_axis(scores, top, axis=1).argsort(axis=1)[:, ::-1]
+        truth.append(np.take_along_axis(top, order, axis=1))
+    return np.vstack(truth)
+
+
+def _wait_indexed(client, collection_name: str, timeout: float = 1800.0) -> float:
+    from qdrant_client.http import models
+
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        info = client.get_collection(collection_name)
+        if info.status == models.CollectionStatus.GREEN:
+            break
+        time.sleep(0.5)
+    return time.perf_counter() - started
+
+
+def run_profile(client, profile, corpus: np.ndarray, queries: np.ndarray, truth: np.ndarray, k: int) -> dict:
+    from qdrant_client.http import models
+    from core.vector_store import ensure_collection
+
+    collection_name = COLLECTION_PREFIX + profile.name.replace("-", "_")
+    if client.collection_exists(collection_name):
+        client.delete_collection(collection_name)
+    dim = profile.vector_size(corpus.shape[1])
+    try:
+        ensure_collection(client, dim, collection_name, profile)
+        # Build the HNSW graph even for small benchmark collections
+        client.update_collection(collection_name, optimizers_config=models.OptimizersConfigDiff(indexing_threshold=1))
+
+        stored = _normalize(corpus[:, :dim])
+        started = time.perf_counter()
+        client.upload_collection(collection_name, vectors=stored, ids=range(len(stored)), batch_size=256, wait=True)
+        upload_seconds = time.perf_counter() - started
+        index_seconds = _wait_indexed(client, collection_name)
+
+        search_params = profile.search_params()
+        probes = _normalize(queries[:, :dim])
+        latencies = []
+        hits = 0
+        for query, expected in zip(probes, truth):
+            started = time.perf_counter()
+            response = client.query_points(collection_name, query=query.tolist(), limit=k, search_params=search_params)
+            latencies.append(time.perf_counter() - started)
+            hits += len({point.id for point in response.points} & set(expected.tolist()))
+
+        memory = profile.estimated_memory(len(corpus), corpus.shape[1])
+        return {
+            "profile": profile.name,
+            "settings": profile.to_dict(),
+            "dimensions": dim,
+            f"recall_at_{k}": hits / (len(truth) * k),
+            "p50_ms": _percentile(latencies, 50) * 1000,
+            "p95_ms": _percentile(latencies, 95) * 1000,
+            "queries_per_sec": len(latencies) / sum(latencies) if latencies else 0.0,
+            "upload_seconds": upload_seconds,
+            "index_seconds": index_seconds,
+            "estimated_ram_mb": memory["ram_bytes"] / 1e6,
+            "estimated_disk_mb": memory["disk_bytes"] / 1e6,
+        }
+    finally:
+        if client.collection_exists(collection_name):
+            client.delete_collection(collection_name)
+
+
+def run(args) -> dict:
+    from qdrant_client import QdrantClient
+    from core.collection_profiles import PROFILES, get_collection_profile
+
+    client = QdrantClient(url=args.url, timeout=300) if args.url else QdrantClient(":memory:")
+    if args.from_collection:
+        corpus, queries = load_collection_vectors(client, args.from_collection, args.points, args.queries, args.seed)
+    else:
+        corpus, queries = make_vectors(args.points, args.queries, args.dim, args.seed)
+    truth = exact_neighbors(corpus, queries, args.k)
+
+    results = []
+    for name in args.profiles or list(PROFILES):
+        print(f"Benchmarking profile '{name}'...")
+        results.append(run_profile(client, get_collection_profile(name), corpus, queries, truth, args.k))
+    return {
+        "config": {
+            "qdrant": args.url or "local (exhaustive search)",
+            "source": args.from_collection or "synthetic",
+            "points": len(corpus),
+            "queries": len(queries),
+            "dim": corpus.shape[1],
+            "k": args.k,
+            "seed": args.seed,
+        },
+        "profiles": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="Qdrant server URL (default: in-process Qdrant)")
+    parser.add_argument("--from-collection", help="benchmark on vectors from this collection at --url")
+    parser.add_argument("--points", type=int, default=20000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--dim", type=int, default=3072, help="synthetic vector dimension")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--profiles", nargs="*", help="profiles to compare (default: all)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    k = results["config"]["k"]
+    print(f"{'profile':<14} {'dim':>5} {f'recall@{k}':>10} {'p50 ms':>8} {'p95 ms':>8} {'RAM MB':>9} {'disk MB':>9}")
+    for row in results["profiles"]:
+        print(f"{row['profile']:<14} {row['dimensions']:>5} {row[f'recall_at_{k}']:>10.3f} {row['p50_ms']:>8.2f} "
+              f"{row['p95_ms']:>8.2f} {row['estimated_ram_mb']:>9.1f} {row['estimated_disk_mb']:>9.1f}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+"""
+Local stand-ins for Gemini and Qdrant Cloud used by the offline benchmarks,
+plus a deterministic synthetic PDF corpus.
+"""
+import os
+import re
+import time
+import random
+import hashlib
+import threading
+from typing import List
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+WORD_RE = re.compile(r"\w+")
+SYLLABLES = ["ka", "lo", "mi", "ra", "ten", "vo", "su", "pel", "dor", "an", "qui", "ber", "no", "sha", "tri", "zu"]
+
+
+class FakeEmbeddings(Embeddings):
+    """
+    Deterministic hashed bag-of-words vectors (L2-normalized), so texts that share words
+    are close and retrieval results are meaningful. latency is slept once per call to
+    stand in for the API round trip.
+    """
+
+    def __init__(self, dim: int = 768, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _vector(self, text: str) -> List[float]:
+        vector = [0.0] * self.dim
+        for word in WORD_RE.findall(text.lower()):
+            digest = hashlib.md5(word.encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dim
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = sum(v * v for v in vector) ** 0.5 or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return [self._vector(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+class FakeChatModel(BaseChatModel):
+    """Chat model that answers after `latency` seconds (spread over `chunks` pieces when streaming)."""
+
+    latency: float = 0.0
+    chunks: int = 8
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-benchmark"
+
+    def _reply(self, messages) -> str:
+        question = next((m.content for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        return f"Based on the retrieved context, here is the answer to: {question}"
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs) -> ChatResult:
+        if self.latency:
+            time.sleep(self.latency)
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._reply(messages)))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        words = self._reply(messages).split(" ")
+        size = max(1, -(-len(words) // self.chunks))
+        for i in range(0, len(words), size):
+            if self.latency:
+                time.sleep(self.latency / self.chunks)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=" ".join(words[i:i + size]) + " "))
+
+
+def make_vocabulary(size: int, seed: int = 0) -> List[str]:
+    rng = random.Random(seed)
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))))
+    return sorted(words)
+
+
+def make_sentence(rng: random.Random, vocabulary: List[str]) -> str:
+    return " ".join(rng.choice(vocabulary) for _ in range(rng.randint(8, 18))).capitalize() + "."
+
+
+def make_synthetic_pdf(path: str, pages: int, seed: int = 0, vocabulary_size: int = 3000) -> List[str]:
+    """
+    Writes a text-layer PDF of `pages` pages (a heading every few pages, ~2.5k chars of body
+    text per page) and returns sentences from it that can serve as benchmark queries.
+    """
+    import fitz
+
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, seed)
+    doc = fitz.open()
+    sentences = []
+    for page_num in range(pages):
+        page = doc.new_page()
+        top = 72
+        if page_num % 4 == 0:
+            page.insert_text((72, top), f"Section {page_num // 4 + 1}: {' '.join(rng.sample(vocabulary, 3)).title()}", fontsize=16)
+            top += 28
+        body = []
+        while sum(len(s) + 1 for s in body) < 2500:
+            body.append(make_sentence(rng, vocabulary))
+        sentences.extend(body)
+        page.insert_textbox(fitz.Rect(72, top, page.rect.width - 72, page.rect.height - 72), " ".join(body), fontsize=9)
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    doc.save(path)
+    doc.close()
+    return sentences
+
+
+def install_fakes(embed_latency: float = 0.0, llm_latency: float = 0.0, dim: int = 768, qdrant_path: str = None) -> FakeEmbeddings:
+    """
+    Registers the fakes in the core resource registry under the keys the real getters use,
+    so get_qdrant_client / get_embeddings_model / get_llm return them. Call before anything
+    else builds those resources. Returns the fake embedder (for call counts).
+    """
+    from qdrant_client import QdrantClient
+    from core import vector_store
+    from core.embedding_cache import CachedEmbeddings
+    from core.rag_chain import LLM_MODEL
+
+    embedder = FakeEmbeddings(dim=dim, latency=embed_latency)
+    vector_store.get_cached_resource(
+        "qdrant_client",
+        (vector_store.QDRANT_URL, vector_store.QDRANT_API_KEY),
+        lambda: QdrantClient(path=qdrant_path) if qdrant_path else QdrantClient(":memory:"),
+    )
+    vector_store.get_cached_resource(
+        "embeddings",
+        (vector_store.EMBEDDING_MODEL, os.getenv("GOOGLE_API_KEY")),
+        lambda: CachedEmbeddings(embedder, model_name=f"fake-{dim}", cache=vector_store.get_embedding_cache()),
+    )
+    vector_store.get_cached_resource("llm", (LLM_MODEL, 0), lambda: FakeChatModel(latency=llm_latency))
+    return embedder
@@ -0,0 +1,187 @@
+"""
+Offline ingest and query benchmark. Drives core.loader and core.splitter (through
+run_ingestion), core.vector_store and core.rag_chain against a deterministic fake
+embedder, a fake LLM with configurable latency and an in-process Qdrant, so runs are
+reproducible and need no credentials. Without --pdf a synthetic corpus is generated.
+
+Usage: python -m benchmarks.pipeline [--pages 200 | --pdf a.pdf b.pdf] [--queries 100]
+                                     [--embed-latency 0.05] [--llm-latency 0.3] [--rerank] [--json out.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import random
+import shutil
+import argparse
+import tempfile
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def _peak_rss_mb(who=None):
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF if who is None else who).ru_maxrss
+    # ru_maxrss is bytes on macOS, kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _configure_env(workdir, args):
+    # Isolated caches so every run starts cold; must happen before core is imported
+    os.environ["EMBEDDING_CACHE_PATH"] = os.path.join(workdir, "embeddings.sqlite")
+    os.environ["SPARSE_INDEX_DIR"] = workdir
+    os.environ["VISION_CACHE_PATH"] = os.path.join(workdir, "vision.sqlite")
+    os.environ["INGEST_REPORT_DIR"] = workdir
+    os.environ["QDRANT_COLLECTION_NAME"] = "benchmark"
+    os.environ["ANSWER_CACHE"] = "true" if args.answer_cache else "false"
+    os.environ["RERANK"] = "true" if args.rerank else "false"
+    os.environ.setdefault("PDF_OCR_FALLBACK", "none")
+    # The fake embedder has no quota
+    os.environ.setdefault("EMBED_REQUESTS_PER_MINUTE", "1000000")
+
+
+def _pdf_sentences(paths):
+    import fitz
+
+    sentences = []
+    for path in paths:
+        with fitz.open(path) as doc:
+            for page in doc:
+                sentences.extend(s for s in SENTENCE_RE.split(page.get_text()) if len(s.split()) >= 6)
+    return sentences
+
+
+def _make_queries(sentences, count, seed):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(count):
+        words = rng.choice(sentences).split()
+        start = rng.randint(0, max(0, len(words) - 6))
+        queries.append("What does the document say about " + " ".join(words[start:start + 6]).strip(".") + "?")
+    return queries
+
+
+def run(args) -> dict:
+    workdir = tempfile.mkdtemp(prefix="rag_bench_")
+    try:
+        _configure_env(workdir, args)
+        from benchmarks.fakes import install_fakes, make_synthetic_pdf
+        from core.ingestion import run_ingestion
+        from core.rag_chain import get_memory_rag_pipeline
+        import fitz
+
+        embedder = install_fakes(args.embed_latency, args.llm_latency, args.dim)
+
+        if args.pdf:
+            paths = args.pdf
+            sentences = _pdf_sentences(paths)
+        else:
+            paths = [os.path.join(workdir, "synthetic.pdf")]
+            sentences = make_synthetic_pdf(paths[0], args.pages, seed=args.seed)
+        pages = 0
+        for path in paths:
+            with fitz.open(path) as doc:
+                pages += doc.page_count
+
+        started = time.perf_counter()
+        stats = run_ingestion(
+            [(path, os.path.basename(path)) for path in paths],
+            incremental=False,
+            include_visuals=False,
+        )
+        ingest_seconds = time.perf_counter() - started
+        ingest_embed_calls = embedder.calls
+        ingest_rss = _peak_rss_mb()
+
+        started = time.perf_counter()
+        pipeline = get_memory_rag_pipeline()
+        build_seconds = time.perf_counter() - started
+
+        latencies = []
+        queries = _make_queries(sentences, args.queries, args.seed)
+        started = time.perf_counter()
+        for query in queries:
+            query_started = time.perf_counter()
+            pipeline.invoke({"question": query, "chat_history": []})
+            latencies.append(time.perf_counter() - query_started)
+        query_seconds = time.perf_counter() - started
+
+        return {
+            "config": {
+                "files": len(paths),
+                "synthetic": not args.pdf,
+                "embed_latency": args.embed_latency,
+                "llm_latency": args.llm_latency,
+                "dim": args.dim,
+                "seed": args.seed,
+                "answer_cache": args.answer_cache,
+                "rerank": args.rerank,
+            },
+            "ingest": {
+                "pages": pages,
+                "chunks": stats["chunks"],
+                "points": stats["points"],
+                "seconds": ingest_seconds,
+                "pages_per_sec": pages / ingest_seconds if ingest_seconds else 0.0,
+                "chunks_per_sec": stats["chunks"] / ingest_seconds if ingest_seconds else 0.0,
+                "embed_calls": ingest_embed_calls,
+                "peak_rss_mb": ingest_rss,
+                "extract_workers_peak_rss_mb": _peak_rss_mb(resource.RUSAGE_CHILDREN) if resource else None,
+            },
+            "query": {
+                "queries": len(latencies),
+                "build_seconds": build_seconds,
+                "p50_ms": _percentile(latencies, 50) * 1000,
+                "p95_ms": _percentile(latencies, 95) * 1000,
+                "mean_ms": sum(latencies) / len(latencies) * 1000 if latencies else 0.0,
+                "queries_per_sec": len(latencies) / query_seconds if query_seconds else 0.0,
+                "embed_calls": embedder.calls - ingest_embed_calls,
+                "peak_rss_mb": _peak_rss_mb(),
+            },
+        }
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pdf", nargs="*", help="PDFs to ingest instead of the synthetic corpus")
+    parser.add_argument("--pages", type=int, default=200, help="pages in the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="seconds per embedding call")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="seconds per LLM call")
+    parser.add_argument("--dim", type=int, default=768, help="fake embedding dimension")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--answer-cache", action="store_true", help="keep the semantic answer cache on")
+    parser.add_argument("--rerank", action="store_true", help="over-fetch and re-rank retrieved chunks")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = run(args)
+    ingest, query = results["ingest"], results["query"]
+    rss = f"{query['peak_rss_mb']:.0f} MB" if query["peak_rss_mb"] is not None else "n/a"
+    print(f"ingest: {ingest['pages']} pages, {ingest['chunks']} chunks in {ingest['seconds']:.1f}s "
+          f"({ingest['pages_per_sec']:.1f} pages/sec, {ingest['chunks_per_sec']:.1f} chunks/sec)")
+    print(f" query: {query['queries']} queries, p50 {query['p50_ms']:.1f} ms, p95 {query['p95_ms']:.1f} ms "
+          f"({query['queries_per_sec']:.1f} queries/sec), peak RSS {rss}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
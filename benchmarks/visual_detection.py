@@ -0,0 +1,122 @@
+"""
+Compares the legacy visual-content detection/render path of process_pdf_images
+(decode every image with fitz.Pixmap, render at 200 DPI, PNG -> PIL -> optimized PNG)
+with the current one (metadata-only size check, xref dedup, adaptive DPI, direct JPEG/WebP).
+No vision calls are made.
+
+Usage: python -m benchmarks.visual_detection path/to/file.pdf [--json out.json]
+"""
+import io
+import json
+import time
+import argparse
+import importlib
+import multiprocessing
+
+from benchmarks.pipeline import _peak_rss_mb
+
+
+def _legacy(file_path):
+    import fitz
+    from PIL import Image
+
+    doc = fitz.open(file_path)
+    rendered = 0
+    encoded_bytes = 0
+    for page_num in range(len(doc)):
+        page = doc.load_page(page_num)
+        has_large_image = False
+        for img in page.get_images(full=True):
+            try:
+                pix = fitz.Pixmap(doc, img[0])
+                if pix.width > 300 and pix.height > 120:
+                    has_large_image = True
+                    break
+                pix = None
+            except Exception:
+                continue
+        if has_large_image:
+            page_pix = page.get_pixmap(dpi=200)
+            img_pil = Image.open(io.BytesIO(page_pix.tobytes("png")))
+            buffered = io.BytesIO()
+            img_pil.save(buffered, format="PNG", optimize=True)
+            rendered += 1
+            encoded_bytes += len(buffered.getvalue())
+    pages = len(doc)
+    doc.close()
+    return pages, rendered, encoded_bytes
+
+
+def _current(file_path):
+    import fitz
+    from core.loader import _page_has_large_image, _render_page
+
+    doc = fitz.open(file_path)
+    rendered = 0
+    encoded_bytes = 0
+    large_xrefs = {}
+    for page_num in range(len(doc)):
+        page = doc.load_page(page_num)
+        if _page_has_large_image(page, large_xrefs):
+            image_url, _, _, _ = _render_page(page)
+            rendered += 1
+            encoded_bytes += len(image_url)
+    pages = len(doc)
+    doc.close()
+    return pages, rendered, encoded_bytes
+
+
+VARIANTS = {"legacy": _legacy, "current": _current}
+# Imported before timing starts, so import cost and memory do not count against a variant
+VARIANT_MODULES = {"legacy": ["fitz", "PIL.Image"], "current": ["fitz", "PIL.Image", "core.loader"]}
+
+
+def _run_variant(name, file_path, results):
+    for module in VARIANT_MODULES[name]:
+        importlib.import_module(module)
+    baseline = _peak_rss_mb()
+    started = time.perf_counter()
+    pages, rendered, encoded_bytes = VARIANTS[name](file_path)
+    seconds = time.perf_counter() - started
+    peak = _peak_rss_mb()
+    results[name] = {
+        "pages": pages,
+        "pages_rendered": rendered,
+        "encoded_bytes": encoded_bytes,
+        "seconds": seconds,
+        "pages_per_sec": pages / seconds if seconds else 0.0,
+        "peak_rss_mb": peak,
+        "peak_rss_growth_mb": (peak - baseline) if peak is not None and baseline is not None else None,
+    }
+
+
+def run(file_path):
+    """Runs each variant in a fresh process so peak RSS is measured independently."""
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Manager() as manager:
+        results = manager.dict()
+        for name in VARIANTS:
+            proc = ctx.Process(target=_run_variant, args=(name, file_path, results))
+            proc.start()
+            proc.join()
+        return dict(results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("pdf")
+    parser.add_argument("--json", help="write results to this file")
+    args = parser.parse_args()
+
+    results = run(args.pdf)
+    for name, r in results.items():
+        rss = f"{r['peak_rss_mb']:.0f} MB" if r["peak_rss_mb"] is not None else "n/a"
+        print(f"{name:>8}: {r['pages_per_sec']:.1f} pages/sec, {r['pages_rendered']} pages rendered, "
+              f"{r['encoded_bytes'] / 1024:.0f} KB encoded, peak RSS {rss}")
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,97 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional
+import numpy as np
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "true").lower() == "true"
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", "3600"))
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "500"))
+
+
+class SemanticAnswerCache:
+    """
+    In-process cache of chain results keyed by the embedding of the standalone question.
+    A lookup hits when a stored question of the same collection version has cosine
+    similarity >= threshold. Entries expire after ttl_seconds; the least recently
+    used entry is dropped beyond max_entries.
+    """
+
+    def __init__(self, threshold: float = ANSWER_CACHE_THRESHOLD, ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS, max_entries: int = ANSWER_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # id -> (version, unit vector, result, created_at)
+        self._next_id = 0
+        self._matrix = None
+        self._matrix_ids = []
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(array)
+        return array / norm if norm else array
+
+    def _expire(self, now: float):
+        expired = [key for key, entry in self._entries.items() if now - entry[3] > self.ttl_seconds]
+        for key in expired:
+            del self._entries[key]
+        if expired:
+            self._matrix = None
+
+    def lookup(self, vector: List[float], version: int) -> Optional[dict]:
+        """Returns the cached result for the most similar question, or None."""
+        query = self._normalize(vector)
+        with self._lock:
+            self._expire(time.time())
+            if self._matrix is None:
+                self._matrix_ids = list(self._entries)
+                self._matrix = (
+                    np.stack([self._entries[key][1] for key in self._matrix_ids])
+                    if self._matrix_ids else None
+                )
+            best_key = None
+            if self._matrix is not None and self._matrix.shape[1] == query.shape[0]:
+                similarities = self._matrix @ query
+                for index in np.argsort(-similarities):
+                    if similarities[index] < self.threshold:
+                        break
+                    key = self._matrix_ids[index]
+                    if self._entries[key][0] == version:
+                        best_key = key
+                        break
+            if best_key is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(best_key)
+            return self._entries[best_key][2]
+
+    def store(self, vector: List[float], version: int, result: dict):
+        with self._lock:
+            self._entries[self._next_id] = (version, self._normalize(vector), result, time.time())
+            self._next_id += 1
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            self._matrix = None
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._matrix = None
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+            }
@@ -0,0 +1,233 @@
+import os
+import asyncio
+import weakref
+from typing import List
+from tenacity import retry, retry_if_not_exception_type, stop_after_attempt, wait_exponential
+from qdrant_client import AsyncQdrantClient
+from langchain_core.documents import Document
+from core.vector_store import get_cached_resource, get_collection_version, COLLECTION_NAME, QDRANT_URL, QDRANT_API_KEY, EMBEDDING_MODEL
+from core.rag_chain import get_memory_rag_pipeline, reciprocal_rank_fusion, LLM_MODEL, HYBRID_SEARCH, SPECULATIVE_RETRIEVAL
+from core.reformulation import same_question
+from core.collection_profiles import get_collection_profile
+
+# Per-stage timeouts (seconds). A rewrite timeout falls back to the raw question;
+# retrieval and answer timeouts raise StageTimeoutError.
+REWRITE_TIMEOUT = float(os.getenv("ASYNC_REWRITE_TIMEOUT", "10"))
+RETRIEVAL_TIMEOUT = float(os.getenv("ASYNC_RETRIEVAL_TIMEOUT", "15"))
+ANSWER_TIMEOUT = float(os.getenv("ASYNC_ANSWER_TIMEOUT", "60"))
+
+
+class StageTimeoutError(TimeoutError):
+    """Raised when a pipeline stage exceeds its timeout."""
+
+    def __init__(self, stage: str, timeout: float):
+        super().__init__(f"{stage} stage timed out after {timeout:g}s")
+        self.stage = stage
+        self.timeout = timeout
+
+
+async def _with_timeout(stage: str, awaitable, timeout: float):
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise StageTimeoutError(stage, timeout) from None
+
+
+# rag_chain.chain_retry, except that a stage timeout fails at once instead of being retried with backoff
+stage_retry = retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, min=2, max=15),
+    retry=retry_if_not_exception_type(StageTimeoutError),
+)
+
+
+def get_async_rag_chain_with_memory_and_sources():
+    """Async counterpart of get_rag_chain_with_memory_and_sources: `await chain(input)`."""
+    return get_async_memory_rag_pipeline().ainvoke
+
+def get_async_streaming_rag_chain_with_memory_and_sources():
+    """Async counterpart of the streaming chain: `async for event in chain(input)`."""
+    return get_async_memory_rag_pipeline().astream
+
+def get_async_memory_rag_pipeline():
+    """Returns the shared AsyncMemoryRagPipeline."""
+    return get_cached_resource(
+        "async_rag_chain",
+        (QDRANT_URL, COLLECTION_NAME, EMBEDDING_MODEL, LLM_MODEL),
+        AsyncMemoryRagPipeline,
+    )
+
+
+class AsyncMemoryRagPipeline:
+    """
+    asyncio variant of MemoryRagPipeline. It shares the sync pipeline's prompts, LLM,
+    reformulator, answer cache, sparse index and context budget, and replaces every
+    network hop with its async counterpart (LLM ainvoke/astream, async embeddings,
+    AsyncQdrantClient), so one event loop can serve many questions concurrently.
+    Cancelling the awaiting task cancels in-flight calls, including speculative retrieval.
+    """
+
+    def __init__(self, pipeline=None):
+        self.pipeline = pipeline or get_memory_rag_pipeline()
+        self.profile = get_collection_profile()
+        # AsyncQdrantClient is bound to the loop it was created on
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self) -> AsyncQdrantClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = AsyncQdrantClient(url=QDRANT_URL, api_key=QDRANT_API_KEY, timeout=120, prefer_grpc=False)
+            self._clients[loop] = client
+        return client
+
+    async def aclose(self):
+        """Closes the Qdrant client of the running loop."""
+        client = self._clients.pop(asyncio.get_running_loop(), None)
+        if client is not None:
+            await client.close()
+
+    async def _dense_search(self, vector: List[float], k: int) -> List[Document]:
+        response = await self._client().query_points(
+            collection_name=COLLECTION_NAME,
+            query=self.profile.truncate(vector),
+            limit=k,
+            search_params=self.profile.search_params(),
+            with_payload=True,
+        )
+        return [
+            Document(
+                page_content=point.payload.get("page_content", ""),
+                metadata={**{key: v for key, v in point.payload.items() if key != "page_content"}, "_id": str(point.id)},
+            )
+            for point in response.points
+        ]
+
+    async def _search(self, query: str, vector: List[float] = None) -> List[Document]:
+        """Dense search (and BM25 in a worker thread when hybrid search is on), fused with RRF."""
+        if vector is None:
+            vector = await self.pipeline.embeddings.aembed_query(query)
+        if not HYBRID_SEARCH:
+            return await self._dense_search(vector, self.pipeline.retrieve_k)
+        retriever = self.pipeline.retriever
+        dense, sparse = await asyncio.gather(
+            self._dense_search(vector, retriever.fetch_k),
+            asyncio.to_thread(retriever._sparse_search, query),
+        )
+        return reciprocal_rank_fusion([dense, sparse], retriever.k, retriever.rrf_k)
+
+    async def _prepare(self, input_data: dict):
+        """Async version of MemoryRagPipeline._prepare. Returns (state, docs); docs is None on a cache hit."""
+        state, docs = await self._prepare_candidates(input_data)
+        if docs and self.pipeline.reranker is not None:
+            # CPU-bound scoring runs in a worker thread so the event loop keeps serving
+            docs = await asyncio.to_thread(self.pipeline.reranker.rerank, state["standalone_question"], docs)
+        return state, docs
+
+    async def _prepare_candidates(self, input_data: dict):
+        pipeline = self.pipeline
+        question = input_data["question"]
+        budget = {}
+        chat_history, history_summary = pipeline.budget.trim_history(input_data.get("chat_history", []), budget)
+
+        standalone_question, rewrite = pipeline.reformulator.plan(question, chat_history)
+        speculative = None
+        try:
+            if standalone_question is None:
+                if SPECULATIVE_RETRIEVAL:
+                    speculative = asyncio.ensure_future(_with_timeout("retrieval", self._search(question), RETRIEVAL_TIMEOUT))
+                standalone_question = await pipeline.reformulator.arewrite(question, chat_history, REWRITE_TIMEOUT)
+
+            state = {
+                "question": question,
+                "chat_history": chat_history,
+                "history_summary": history_summary,
+                "budget": budget,
+                "standalone_question": standalone_question,
+                "rewrite": rewrite,
+                "query_vector": None,
+                "version": get_collection_version(),
+                "cached": None,
+            }
+
+            if pipeline.answer_cache is not None:
+                try:
+                    state["query_vector"] = await _with_timeout(
+                        "retrieval", pipeline.embeddings.aembed_query(standalone_question), RETRIEVAL_TIMEOUT
+                    )
+                    state["cached"] = pipeline.answer_cache.lookup(state["query_vector"], state["version"])
+                    if state["cached"] is not None:
+                        return state, None
+                except Exception as e:
+                    print(f"DEBUG: Answer cache lookup skipped: {str(e)}")
+
+            raw_docs = None
+            if speculative is not None:
+                try:
+                    raw_docs = await speculative
+                except Exception as e:
+                    print(f"DEBUG: Speculative retrieval failed: {str(e)}")
+            if raw_docs is not None and same_question(standalone_question, question):
+                return state, raw_docs
+
+            try:
+                docs = await _with_timeout("retrieval", self._search(standalone_question, state["query_vector"]), RETRIEVAL_TIMEOUT)
+            except Exception:
+                # Same fallbacks as the sync pipeline: speculative results, then the raw question
+                if raw_docs is not None:
+                    return state, raw_docs
+                if chat_history and standalone_question != question:
+                    return state, await _with_timeout("retrieval", self._search(question), RETRIEVAL_TIMEOUT)
+                raise
+            if raw_docs:
+                docs = reciprocal_rank_fusion([docs, raw_docs], pipeline.retrieve_k)
+            return state, docs
+        finally:
+            if speculative is not None and not speculative.done():
+                speculative.cancel()
+
+    @stage_retry
+    async def ainvoke(self, input_data: dict) -> dict:
+        state, docs = await self._prepare(input_data)
+        if state["cached"] is not None:
+            return {**state["cached"], "cached": True, "budget": state["budget"]}
+        answer = await _with_timeout(
+            "answer",
+            self.pipeline.qa_chain.ainvoke(self.pipeline._qa_input(state, docs)),
+            ANSWER_TIMEOUT,
+        )
+        return self.pipeline._finish(state, docs, answer)
+
+    async def astream(self, input_data: dict):
+        """
+        Yields the same events as MemoryRagPipeline.stream. ANSWER_TIMEOUT bounds the whole
+        token stream; closing the generator early stops the LLM stream.
+        """
+        state, docs = await stage_retry(self._prepare)(input_data)
+        if state["cached"] is not None:
+            cached = state["cached"]
+            yield {"type": "sources", "sources": cached["sources"], "chunks": cached["chunks"]}
+            yield {"type": "token", "text": cached["answer"]}
+            yield {"type": "done", **cached, "cached": True, "budget": state["budget"]}
+            return
+
+        yield {
+            "type": "sources",
+            "sources": list(set([doc.metadata.get("source", "Unknown") for doc in docs])),
+            "chunks": [doc.page_content for doc in docs],
+        }
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ANSWER_TIMEOUT
+        tokens = self.pipeline.qa_chain.astream(self.pipeline._qa_input(state, docs))
+        parts = []
+        try:
+            while True:
+                try:
+                    token = await _with_timeout("answer", tokens.__anext__(), max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    break
+                parts.append(token)
+                yield {"type": "token", "text": token}
+        finally:
+            await tokens.aclose()
+        yield {"type": "done", **self.pipeline._finish(state, docs, "".join(parts))}
@@ -0,0 +1,163 @@
+import os
+import math
+from typing import List, Optional
+from qdrant_client.http import models
+from langchain_core.embeddings import Embeddings
+
+COLLECTION_PROFILE = os.getenv("QDRANT_COLLECTION_PROFILE", "default")
+
+# Qdrant's default graph degree, used for memory estimates when a profile leaves it unset
+DEFAULT_HNSW_M = 16
+
+# Memory for a 3072-dim gemini-embedding-001 collection, per million vectors (see estimated_memory):
+#   default      ~12.4 GB RAM (float32 vectors + graph)
+#   scalar       ~3.2 GB RAM (int8 copy), originals on disk for rescoring
+#   binary       ~0.5 GB RAM (1 bit per dimension), originals on disk for rescoring
+#   *-1536       same, with vectors truncated to the first 1536 dimensions (Matryoshka)
+PROFILES = {
+    "default": {},
+    "scalar": {"quantization": "scalar", "on_disk": True, "oversampling": 2.0, "search_ef": 128},
+    "binary": {"quantization": "binary", "on_disk": True, "oversampling": 3.0, "search_ef": 128},
+    "scalar-1536": {"quantization": "scalar", "on_disk": True, "oversampling": 2.0, "search_ef": 128, "dimensions": 1536},
+    "binary-1536": {"quantization": "binary", "on_disk": True, "oversampling": 3.0, "search_ef": 128, "dimensions": 1536},
+}
+
+
+def _env_int(name: str) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else None
+
+
+class CollectionProfile:
+    """
+    How the Qdrant collection stores and searches vectors.
+    quantization: None, "scalar" (int8, 4x smaller) or "binary" (1 bit per dimension, 32x
+        smaller); the quantized copy is kept in RAM and searched first.
+    on_disk: keep the original float32 vectors on disk (memory-mapped). With quantization
+        they are only read to rescore the top oversampling * k candidates.
+    hnsw_m / hnsw_ef_construct: graph degree and build-time beam width (None = Qdrant default).
+    search_ef: search-time beam width (None = Qdrant default).
+    dimensions: truncate embeddings to their first N dimensions (valid for Matryoshka-trained
+        models such as gemini-embedding-001, for 768 / 1536 / 3072).
+    """
+
+    def __init__(
+        self,
+        name: str = "custom",
+        quantization: Optional[str] = None,
+        on_disk: bool = False,
+        rescore: bool = True,
+        oversampling: float = 2.0,
+        hnsw_m: Optional[int] = None,
+        hnsw_ef_construct: Optional[int] = None,
+        hnsw_on_disk: bool = False,
+        search_ef: Optional[int] = None,
+        dimensions: Optional[int] = None,
+    ):
+        if quantization not in (None, "scalar", "binary"):
+            raise ValueError(f"Unknown quantization '{quantization}' (expected 'scalar' or 'binary').")
+        self.name = name
+        self.quantization = quantization
+        self.on_disk = on_disk
+        self.rescore = rescore
+        self.oversampling = oversampling
+        self.hnsw_m = hnsw_m
+        self.hnsw_ef_construct = hnsw_ef_construct
+        self.hnsw_on_disk = hnsw_on_disk
+        self.search_ef = search_ef
+        self.dimensions = dimensions
+
+    def vector_size(self, embedding_dim: int) -> int:
+        return min(self.dimensions, embedding_dim) if self.dimensions else embedding_dim
+
+    def truncate(self, vector: List[float]) -> List[float]:
+        """Keeps the first `dimensions` values and re-normalizes (no-op without truncation)."""
+        if not self.dimensions or len(vector) <= self.dimensions:
+            return vector
+        head = vector[:self.dimensions]
+        norm = math.sqrt(sum(v * v for v in head)) or 1.0
+        return [v / norm for v in head]
+
+    def hnsw_config(self) -> models.HnswConfigDiff:
+        return models.HnswConfigDiff(m=self.hnsw_m, ef_construct=self.hnsw_ef_construct, on_disk=self.hnsw_on_disk)
+
+    def vectors_config(self, vector_dim: int) -> models.VectorParams:
+        return models.VectorParams(
+            size=vector_dim,
+            distance=models.Distance.COSINE,
+            on_disk=self.on_disk,
+            hnsw_config=self.hnsw_config(),
+        )
+
+    def quantization_config(self):
+        if self.quantization == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+            )
+        if self.quantization == "binary":
+            return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+        return None
+
+    def search_params(self, exact: bool = False) -> Optional[models.SearchParams]:
+        """Search-time settings, or None when Qdrant's defaults apply."""
+        if not exact and self.quantization is None and self.search_ef is None:
+            return None
+        quantization = None
+        if self.quantization is not None:
+            quantization = models.QuantizationSearchParams(
+                rescore=self.rescore,
+                oversampling=self.oversampling if self.rescore else None,
+            )
+        return models.SearchParams(hnsw_ef=self.search_ef, exact=exact, quantization=quantization)
+
+    def estimated_memory(self, points: int, embedding_dim: int) -> dict:
+        """
+        Rough RAM / disk footprint in bytes of the vectors and HNSW graph (payloads and
+        segment overhead excluded). The level-0 graph stores 2 * m 4-byte links per point.
+        """
+        dim = self.vector_size(embedding_dim)
+        originals = points * dim * 4
+        quantized = {"scalar": points * dim, "binary": points * math.ceil(dim / 8)}.get(self.quantization, 0)
+        graph = points * 2 * (self.hnsw_m or DEFAULT_HNSW_M) * 4
+        ram = quantized + (0 if self.on_disk else originals) + (0 if self.hnsw_on_disk else graph)
+        disk = originals + quantized + graph
+        return {"ram_bytes": ram, "disk_bytes": disk, "dimensions": dim}
+
+    def to_dict(self) -> dict:
+        return dict(vars(self))
+
+
+def get_collection_profile(name: Optional[str] = None) -> CollectionProfile:
+    """
+    Returns the named profile (default: QDRANT_COLLECTION_PROFILE). QDRANT_HNSW_M,
+    QDRANT_HNSW_EF_CONSTRUCT, QDRANT_SEARCH_EF and QDRANT_VECTOR_DIM override its settings.
+    """
+    name = name or COLLECTION_PROFILE
+    if name not in PROFILES:
+        raise ValueError(f"Unknown collection profile '{name}' (available: {', '.join(PROFILES)}).")
+    settings = dict(PROFILES[name])
+    overrides = {
+        "hnsw_m": _env_int("QDRANT_HNSW_M"),
+        "hnsw_ef_construct": _env_int("QDRANT_HNSW_EF_CONSTRUCT"),
+        "search_ef": _env_int("QDRANT_SEARCH_EF"),
+        "dimensions": _env_int("QDRANT_VECTOR_DIM"),
+    }
+    settings.update({key: value for key, value in overrides.items() if value is not None})
+    return CollectionProfile(name=name, **settings)
+
+
+class TruncatedEmbeddings(Embeddings):
+    """Wraps an embeddings model so that query and document vectors match a truncating profile."""
+
+    def __init__(self, embeddings: Embeddings, profile: CollectionProfile):
+        self.embeddings = embeddings
+        self.profile = profile
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self.profile.truncate(vector) for vector in self.embeddings.embed_documents(texts)]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.profile.truncate(self.embeddings.embed_query(text))
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return self.profile.truncate(await self.embeddings.aembed_query(text))
@@ -0,0 +1,155 @@
+import os
+import re
+from typing import List, Optional
+from langchain_core.documents import Document
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "3000"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1500"))
+SUMMARY_MAX_TOKENS = int(os.getenv("SUMMARY_MAX_TOKENS", "300"))
+HISTORY_RECENT_MESSAGES = int(os.getenv("HISTORY_RECENT_MESSAGES", "6"))
+
+# Must cover the splitter's chunk_overlap (200 chars) with some slack
+MAX_OVERLAP_CHARS = 300
+MIN_OVERLAP_CHARS = 30
+SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+
+
+def count_tokens(text: str) -> int:
+    """
+    Token estimate (~4 characters per token for English with Gemini's tokenizer).
+    Counting exactly would need an API round trip per message.
+    """
+    return (len(text) + 3) // 4
+
+
+def _role_and_content(message):
+    if isinstance(message, BaseMessage):
+        return ("user" if isinstance(message, HumanMessage) else "assistant"), str(message.content)
+    return message["role"], message["content"]
+
+
+def _to_message(role: str, content: str) -> BaseMessage:
+    return HumanMessage(content=content) if role == "user" else AIMessage(content=content)
+
+
+def _first_sentence(text: str, max_chars: int = 160) -> str:
+    sentence = SENTENCE_RE.split(text.strip(), maxsplit=1)[0]
+    return sentence if len(sentence) <= max_chars else sentence[:max_chars].rstrip() + "..."
+
+
+def _overlap(a: str, b: str) -> int:
+    """Length of the longest suffix of a that is a prefix of b (within the splitter overlap range)."""
+    for size in range(min(MAX_OVERLAP_CHARS, len(a), len(b)), MIN_OVERLAP_CHARS - 1, -1):
+        if a.endswith(b[:size]):
+            return size
+    return 0
+
+
+class ContextBudget:
+    """
+    Keeps prompt size bounded: the most recent messages within history_tokens are passed
+    as chat history, older ones are folded into a short extractive summary, and retrieved
+    chunks are deduplicated, de-overlapped and packed into context_tokens.
+    """
+
+    def __init__(
+        self,
+        context_tokens: int = CONTEXT_MAX_TOKENS,
+        history_tokens: int = HISTORY_MAX_TOKENS,
+        summary_tokens: int = SUMMARY_MAX_TOKENS,
+        recent_messages: int = HISTORY_RECENT_MESSAGES,
+    ):
+        self.context_tokens = context_tokens
+        self.history_tokens = history_tokens
+        self.summary_tokens = summary_tokens
+        self.recent_messages = recent_messages
+
+    def trim_history(self, chat_history: list, report: Optional[dict] = None):
+        """
+        Accepts BaseMessages or {"role", "content"} dicts (only the kept ones are converted).
+        Returns (recent messages, summary of older ones).
+        """
+        kept = []
+        used = 0
+        for message in reversed(chat_history):
+            if len(kept) >= self.recent_messages:
+                break
+            role, content = _role_and_content(message)
+            tokens = count_tokens(content)
+            if kept and used + tokens > self.history_tokens:
+                break
+            kept.append((role, content))
+            used += tokens
+        kept.reverse()
+        older = chat_history[:len(chat_history) - len(kept)]
+
+        summary_lines = []
+        summary_used = 0
+        # Newest older turns first, so the summary keeps what is closest to the present
+        for message in reversed(older):
+            role, content = _role_and_content(message)
+            line = f"- {'User asked' if role == 'user' else 'Assistant answered'}: {_first_sentence(content)}"
+            tokens = count_tokens(line)
+            if summary_used + tokens > self.summary_tokens:
+                break
+            summary_lines.append(line)
+            summary_used += tokens
+        summary_lines.reverse()
+
+        if report is not None:
+            report.update({
+                "history_messages": len(kept),
+                "history_tokens": used,
+                "summarized_messages": len(older),
+                "summary_tokens": summary_used,
+            })
+        return [_to_message(role, content) for role, content in kept], "\n".join(summary_lines)
+
+    def pack_documents(self, docs: List[Document], report: Optional[dict] = None) -> List[Document]:
+        """
+        Drops duplicate chunks, trims text shared with an already selected neighbouring chunk
+        (the splitter's chunk_overlap), and keeps docs in rank order until the token budget is used.
+        """
+        packed = []
+        used = 0
+        seen = set()
+        trimmed_chars = 0
+        dropped = 0
+        for doc in docs:
+            text = doc.page_content.strip()
+            if text in seen:
+                dropped += 1
+                continue
+            seen.add(text)
+            source = doc.metadata.get("source")
+            for other in packed:
+                if other.metadata.get("source") != source:
+                    continue
+                head = _overlap(other.page_content, text)
+                tail = _overlap(text, other.page_content)
+                if head:
+                    text = text[head:]
+                    trimmed_chars += head
+                if tail:
+                    text = text[:len(text) - tail]
+                    trimmed_chars += tail
+            if not text.strip():
+                dropped += 1
+                continue
+            tokens = count_tokens(text)
+            if used + tokens > self.context_tokens:
+                dropped += 1
+                continue
+            packed.append(Document(page_content=text, metadata=doc.metadata))
+            used += tokens
+
+        if report is not None:
+            report.update({
+                "context_tokens": used,
+                "context_budget": self.context_tokens,
+                "chunks_used": len(packed),
+                "chunks_dropped": dropped,
+                "overlap_chars_trimmed": trimmed_chars,
+            })
+        return packed
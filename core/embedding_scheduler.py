@@ -0,0 +1,123 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Optional
+
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "64"))
+EMBED_MAX_WORKERS = int(os.getenv("EMBED_MAX_WORKERS", "4"))
+EMBED_REQUESTS_PER_MINUTE = float(os.getenv("EMBED_REQUESTS_PER_MINUTE", "60"))
+
+RATE_LIMIT_MARKERS = ("429", "quota", "resource exhausted", "resource_exhausted", "rate limit")
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for 429 / quota style errors from the Gemini API."""
+    message = str(error).lower()
+    return any(marker in message for marker in RATE_LIMIT_MARKERS)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. The refill rate adapts to the API:
+    it is halved on every rate-limit error and recovers slowly on success.
+    """
+
+    def __init__(self, rate_per_second: float, capacity: Optional[float] = None, min_rate: float = 0.05):
+        self.max_rate = rate_per_second
+        self.rate = rate_per_second
+        self.min_rate = min_rate
+        self.capacity = capacity or max(1.0, rate_per_second)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def acquire(self):
+        """Blocks until a token is available."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self):
+        with self._lock:
+            self._refill()
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+
+    def reward(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+
+class EmbeddingScheduler:
+    """
+    Splits texts into batches and embeds them on a bounded thread pool,
+    paced by a shared TokenBucket. Batches go through the embeddings model
+    (normally CachedEmbeddings), so every finished batch is persisted and a
+    re-run after a failure only pays for the batches that did not complete.
+    """
+
+    def __init__(
+        self,
+        embeddings,
+        batch_size: int = EMBED_BATCH_SIZE,
+        max_workers: int = EMBED_MAX_WORKERS,
+        requests_per_minute: float = EMBED_REQUESTS_PER_MINUTE,
+        max_retries: int = 6,
+    ):
+        self.embeddings = embeddings
+        self.batch_size = batch_size
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.bucket = TokenBucket(requests_per_minute / 60.0)
+        self.rate_limited = 0
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            self.bucket.acquire()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+                self.bucket.reward()
+                return vectors
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt == self.max_retries:
+                    raise
+                self.rate_limited += 1
+                self.bucket.penalize()
+                wait = min(60, 2 ** (attempt + 1))
+                print(f"DEBUG: Embedding quota hit, slowing down to {self.bucket.rate * 60:.1f} req/min (retry in {wait}s)...")
+                time.sleep(wait)
+
+    def embed(self, texts: List[str], progress_callback: Optional[Callable[[int, int], None]] = None) -> List[List[float]]:
+        """Embeds texts in order. progress_callback(done_texts, total_texts) is called per batch."""
+        batches = [texts[i:i + self.batch_size] for i in range(0, len(texts), self.batch_size)]
+        results = [None] * len(batches)
+        done = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=max(1, self.max_workers)) as executor:
+            futures = {executor.submit(self._embed_batch, batch): i for i, batch in enumerate(batches)}
+            for future in as_completed(futures):
+                i = futures[future]
+                try:
+                    results[i] = future.result()
+                except Exception as e:
+                    errors.append(e)
+                    continue
+                done += len(batches[i])
+                if progress_callback:
+                    progress_callback(done, len(texts))
+        if errors:
+            completed = sum(1 for r in results if r is not None)
+            print(f"DEBUG: {completed}/{len(batches)} embedding batches completed before failure.")
+            raise errors[0]
+        return [vector for batch in results for vector in batch]
@@ -1,80 +1,305 @@
 import json
 import os
-from datetime import datetime
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
 import uuid
 
 CHATS_DIR = "chats"
+HISTORY_DB_PATH = os.getenv("HISTORY_DB_PATH", os.path.join(CHATS_DIR, "history.sqlite"))
+# One append-only JSON Lines log of messages per chat
+LOGS_DIR = os.path.join(CHATS_DIR, "logs")
+# Legacy per-chat JSON files are moved here once imported into the index
+MIGRATED_DIR = os.path.join(CHATS_DIR, "migrated")
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "20"))
+# A log is compacted once it holds this many times more records than the chat has messages
+LOG_COMPACT_RATIO = float(os.getenv("HISTORY_LOG_COMPACT_RATIO", "2"))
+
+# Chats not updated for this long are expired by the background sweeper
+RETENTION_DAYS = float(os.getenv("HISTORY_RETENTION_DAYS", "7"))
+RETENTION_SWEEP_INTERVAL_SECONDS = float(os.getenv("HISTORY_SWEEP_INTERVAL_SECONDS", "3600"))
+
+_conn = None
+_lock = threading.RLock()
+_sweeper = None
+_sweeper_stop = threading.Event()
+_retention_status = {"runs": 0, "last_run": None, "last_expired": 0, "total_expired": 0, "last_duration": 0.0, "last_error": None}
 
 def ensure_chats_dir():
-    if not os.path.exists(CHATS_DIR):
-        os.makedirs(CHATS_DIR)
+    for directory in (CHATS_DIR, LOGS_DIR):
+        if not os.path.exists(directory):
+            os.makedirs(directory)
 
-def save_chat(chat_id, messages, username, title=None):
-    ensure_chats_dir()
-    if not title and messages:
-        # Use the first 30 chars of the first user message as title
-        first_user_msg = next((m["content"] for m in messages if m["role"] == "user"), "New Chat")
-        title = first_user_msg[:30] + "..." if len(first_user_msg) > 30 else first_user_msg
+def _log_path(chat_id):
+    return os.path.join(LOGS_DIR, f"{chat_id}.jsonl")
 
-    chat_data = {
-        "id": chat_id,
-        "username": username,
-        "title": title or "New Chat",
-        "updated_at": datetime.now().isoformat(),
-        "messages": messages
-    }
-    
-    file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(chat_data, f, indent=4)
+def _encode(index, message):
+    return json.dumps({"i": index, "m": message}, ensure_ascii=False) + "\n"
 
-def load_chat(chat_id, username):
-    file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
-    if os.path.exists(file_path):
-        with open(file_path, "r", encoding="utf-8") as f:
-            data = json.load(f)
-            if data.get("username") == username:
-                return data
-    return None
-
-def list_chats(username):
-    ensure_chats_dir()
-    cleanup_old_chats() # Auto-cleanup when listing
-    chats = []
-    for filename in os.listdir(CHATS_DIR):
-        if filename.endswith(".json"):
+def _append_log(chat_id, start, messages):
+    """
+    Appends messages[start:] in one write and fsyncs. Records carry their message index,
+    so re-appending after a crash between log and index update is harmless on replay.
+    """
+    path = _log_path(chat_id)
+    with open(path, "a+b") as f:
+        # Drop a torn last line left by a crash mid-append
+        size = f.seek(0, os.SEEK_END)
+        if size:
+            f.seek(size - 1)
+            if f.read(1) != b"\n":
+                f.seek(0)
+                data = f.read()
+                f.truncate(data.rfind(b"\n") + 1)
+        f.write("".join(_encode(start + i, m) for i, m in enumerate(messages[start:])).encode("utf-8"))
+        f.flush()
+        os.fsync(f.fileno())
+
+def _write_log(chat_id, messages):
+    """Atomically replaces the log with one record per message (used for compaction and rewrites)."""
+    path = _log_path(chat_id)
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("".join(_encode(i, m) for i, m in enumerate(messages)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def _replay_log(chat_id, message_count):
+    """Rebuilds the message list; later records for an index win, unparsable lines are skipped."""
+    messages = {}
+    records = 0
+    try:
+        with open(_log_path(chat_id), "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                records += 1
+                messages[record["i"]] = record["m"]
+    except FileNotFoundError:
+        pass
+    ordered = []
+    while len(ordered) < message_count and len(ordered) in messages:
+        ordered.append(messages[len(ordered)])
+    return ordered, records
+
+def _get_conn():
+    """
+    Shared SQLite connection (one per process, serialized by _lock).
+    Created on first use; older storage formats are migrated at that point.
+    """
+    global _conn
+    with _lock:
+        if _conn is None:
+            ensure_chats_dir()
+            directory = os.path.dirname(HISTORY_DB_PATH)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            conn = sqlite3.connect(HISTORY_DB_PATH, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS chat_index ("
+                "id TEXT PRIMARY KEY, username TEXT NOT NULL, title TEXT NOT NULL, "
+                "updated_at TEXT NOT NULL, message_count INTEGER NOT NULL, log_records INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_index_user_updated ON chat_index(username, updated_at DESC)")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_chat_index_updated ON chat_index(updated_at)")
+            conn.commit()
+            _conn = conn
+            migrate_json_chats()
+        return _conn
+
+def _import_chat(chat_id, username, title, updated_at, messages):
+    conn = _get_conn()
+    if conn.execute("SELECT 1 FROM chat_index WHERE id = ?", (chat_id,)).fetchone():
+        return
+    _write_log(chat_id, messages)
+    conn.execute(
+        "INSERT INTO chat_index (id, username, title, updated_at, message_count, log_records) VALUES (?, ?, ?, ?, ?, ?)",
+        (chat_id, username, title or "New Chat", updated_at, len(messages), len(messages)),
+    )
+    conn.commit()
+
+def migrate_json_chats():
+    """
+    Imports legacy chats/<id>.json files into the index and moves them to chats/migrated/.
+    Chats already in the index are kept as they are. Returns the number of files imported.
+    """
+    imported = 0
+    with _lock:
+        for filename in os.listdir(CHATS_DIR):
+            if not filename.endswith(".json"):
+                continue
             file_path = os.path.join(CHATS_DIR, filename)
             try:
                 with open(file_path, "r", encoding="utf-8") as f:
                     data = json.load(f)
-                    # Only include chats for the specific user
-                    if data.get("username") == username:
-                        chats.append({
-                            "id": data["id"],
-                            "title": data["title"],
-                            "updated_at": data["updated_at"]
-                        })
+                _import_chat(data["id"], data.get("username", ""), data.get("title"), data["updated_at"], data.get("messages", []))
             except Exception:
                 continue
-    # Sort by updated_at descending
-    return sorted(chats, key=lambda x: x["updated_at"], reverse=True)
+            if not os.path.exists(MIGRATED_DIR):
+                os.makedirs(MIGRATED_DIR)
+            os.replace(file_path, os.path.join(MIGRATED_DIR, filename))
+            imported += 1
+    return imported
+
+def save_chat(chat_id, messages, username, title=None):
+    """
+    Persists the chat. Only messages beyond those already stored are appended to the
+    log; a shorter list (history was rewritten) replaces the log instead.
+    """
+    if not title and messages:
+        # Use the first 30 chars of the first user message as title
+        first_user_msg = next((m["content"] for m in messages if m["role"] == "user"), "New Chat")
+        title = first_user_msg[:30] + "..." if len(first_user_msg) > 30 else first_user_msg
+
+    conn = _get_conn()
+    with _lock:
+        row = conn.execute("SELECT message_count, log_records FROM chat_index WHERE id = ?", (chat_id,)).fetchone()
+        stored, records = row if row else (0, 0)
+        if len(messages) < stored or records + len(messages) - stored > LOG_COMPACT_RATIO * max(len(messages), 1):
+            _write_log(chat_id, messages)
+            records = len(messages)
+        elif len(messages) > stored:
+            _append_log(chat_id, stored, messages)
+            records += len(messages) - stored
+        conn.execute(
+            "INSERT INTO chat_index (id, username, title, updated_at, message_count, log_records) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(id) DO UPDATE SET username = excluded.username, title = excluded.title, "
+            "updated_at = excluded.updated_at, message_count = excluded.message_count, log_records = excluded.log_records",
+            (chat_id, username, title or "New Chat", datetime.now().isoformat(), len(messages), records),
+        )
+        conn.commit()
+
+def load_chat(chat_id, username):
+    conn = _get_conn()
+    with _lock:
+        row = conn.execute(
+            "SELECT id, username, title, updated_at, message_count FROM chat_index WHERE id = ? AND username = ?",
+            (chat_id, username),
+        ).fetchone()
+    if row is None:
+        return None
+    messages, _ = _replay_log(chat_id, row[4])
+    return {
+        "id": row[0],
+        "username": row[1],
+        "title": row[2],
+        "updated_at": row[3],
+        "messages": messages,
+    }
+
+def compact_chat(chat_id):
+    """Rewrites the chat's log with exactly one record per message."""
+    conn = _get_conn()
+    with _lock:
+        row = conn.execute("SELECT message_count FROM chat_index WHERE id = ?", (chat_id,)).fetchone()
+        if row is None:
+            return
+        messages, _ = _replay_log(chat_id, row[0])
+        _write_log(chat_id, messages)
+        conn.execute(
+            "UPDATE chat_index SET message_count = ?, log_records = ? WHERE id = ?",
+            (len(messages), len(messages), chat_id),
+        )
+        conn.commit()
+
+def list_chats(username, limit=None, offset=0):
+    """Chats of the user, most recently updated first. limit/offset page through the list."""
+    conn = _get_conn()
+    with _lock:
+        rows = conn.execute(
+            "SELECT id, title, updated_at FROM chat_index WHERE username = ? "
+            "ORDER BY updated_at DESC LIMIT ? OFFSET ?",
+            (username, -1 if limit is None else limit, offset),
+        ).fetchall()
+    return [{"id": row[0], "title": row[1], "updated_at": row[2]} for row in rows]
+
+def count_chats(username):
+    conn = _get_conn()
+    with _lock:
+        return conn.execute("SELECT COUNT(*) FROM chat_index WHERE username = ?", (username,)).fetchone()[0]
+
+def _remove_log(chat_id):
+    try:
+        os.remove(_log_path(chat_id))
+    except FileNotFoundError:
+        pass
 
 def delete_chat(chat_id):
-    file_path = os.path.join(CHATS_DIR, f"{chat_id}.json")
-    if os.path.exists(file_path):
-        os.remove(file_path)
-
-def cleanup_old_chats(days=7):
-    ensure_chats_dir()
-    now = datetime.now()
-    for filename in os.listdir(CHATS_DIR):
-        if filename.endswith(".json"):
-            file_path = os.path.join(CHATS_DIR, filename)
-            try:
-                with open(file_path, "r", encoding="utf-8") as f:
-                    data = json.load(f)
-                    updated_at = datetime.fromisoformat(data["updated_at"])
-                    if (now - updated_at).days >= days:
-                        os.remove(file_path)
-            except Exception:
-                continue
+    conn = _get_conn()
+    with _lock:
+        conn.execute("DELETE FROM chat_index WHERE id = ?", (chat_id,))
+        conn.commit()
+        _remove_log(chat_id)
+
+def cleanup_old_chats(days=RETENTION_DAYS):
+    """
+    Deletes chats not updated for `days`. Each delete re-checks updated_at, so a chat
+    saved by another process after the scan survives. Returns the number expired.
+    """
+    # ISO timestamps sort chronologically, so this is a range scan on idx_chat_index_updated
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    conn = _get_conn()
+    expired = 0
+    with _lock:
+        candidates = [row[0] for row in conn.execute(
+            "SELECT id FROM chat_index WHERE updated_at <= ?", (cutoff,)
+        ).fetchall()]
+        for chat_id in candidates:
+            if conn.execute("DELETE FROM chat_index WHERE id = ? AND updated_at <= ?", (chat_id, cutoff)).rowcount:
+                _remove_log(chat_id)
+                expired += 1
+        conn.commit()
+    return expired
+
+def sweep_expired_chats(days=RETENTION_DAYS):
+    """Runs one retention pass and records it in get_retention_status()."""
+    start = time.perf_counter()
+    expired = 0
+    error = None
+    try:
+        expired = cleanup_old_chats(days)
+    except Exception as e:
+        error = str(e)
+    with _lock:
+        _retention_status["runs"] += 1
+        _retention_status["last_run"] = datetime.now().isoformat()
+        _retention_status["last_expired"] = expired
+        _retention_status["total_expired"] += expired
+        _retention_status["last_duration"] = time.perf_counter() - start
+        _retention_status["last_error"] = error
+    return expired
+
+def _sweep_loop(interval, days):
+    while True:
+        sweep_expired_chats(days)
+        if _sweeper_stop.wait(interval):
+            break
+
+def start_retention_sweeper(interval=RETENTION_SWEEP_INTERVAL_SECONDS, days=RETENTION_DAYS):
+    """
+    Starts the background retention thread (once per process; later calls are no-ops).
+    The first sweep runs immediately, then every `interval` seconds.
+    """
+    global _sweeper
+    with _lock:
+        if _sweeper is not None and _sweeper.is_alive():
+            return
+        _sweeper_stop.clear()
+        _sweeper = threading.Thread(target=_sweep_loop, args=(interval, days), name="history-retention", daemon=True)
+        _sweeper.start()
+
+def stop_retention_sweeper():
+    global _sweeper
+    _sweeper_stop.set()
+    if _sweeper is not None:
+        _sweeper.join()
+    _sweeper = None
+
+def get_retention_status():
+    with _lock:
+        return {**_retention_status, "running": _sweeper is not None and _sweeper.is_alive()}
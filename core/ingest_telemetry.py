@@ -0,0 +1,160 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from typing import List, Optional
+
+INGEST_REPORT_DIR = os.getenv("INGEST_REPORT_DIR", os.path.join(".cache", "ingest_reports"))
+# List-price estimates (USD); override when pricing or models change
+EMBEDDING_COST_PER_1M_TOKENS = float(os.getenv("EMBEDDING_COST_PER_1M_TOKENS", "0.15"))
+VISION_COST_PER_CALL = float(os.getenv("VISION_COST_PER_CALL", "0.00025"))
+
+STAGES = ("extract", "vision", "split", "embed", "upload")
+
+
+class IngestTelemetry:
+    """
+    Counters and timings for one run_ingestion call: per file (pages, extraction,
+    vision and split time, chunks, vision calls) and per stage, plus embedding usage,
+    bytes uploaded and an estimated API cost. Stage times are summed work time; stages
+    overlap, so they can add up to more than the wall-clock total.
+    Updated from the pipeline threads; progress() and report() may be read at any time.
+    """
+
+    def __init__(self, files: List[tuple], include_visuals: bool = True):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.finished = None
+        self.include_visuals = include_visuals
+        self.files = [
+            {
+                "filename": entry[1],
+                "pages": 0,
+                "status": "pending",
+                "error": None,
+                "extract_seconds": 0.0,
+                "vision_seconds": 0.0,
+                "vision_pages": 0,
+                "vision_calls": 0,
+                "vision_cache_hits": 0,
+                "split_seconds": 0.0,
+                "chunks": 0,
+            }
+            for entry in files
+        ]
+        self._by_name = {entry["filename"]: entry for entry in self.files}
+        self.stage_seconds = {stage: 0.0 for stage in STAGES}
+        self.pages_total = 0
+        self.pages_extracted = 0
+        self.files_loaded = 0
+        self.chunks_split = 0
+        self.chunks_indexed = 0
+        self.index_stats = {}
+
+    def set_page_counts(self, page_counts: dict):
+        with self._lock:
+            for index, pages in page_counts.items():
+                self.files[index]["pages"] = pages
+            self.pages_total = sum(page_counts.values())
+
+    def part_extracted(self, index: int, pages: int, seconds: float):
+        with self._lock:
+            self.files[index]["extract_seconds"] += seconds
+            self.stage_seconds["extract"] += seconds
+            self.pages_extracted += pages
+
+    def vision_done(self, index: int, seconds: float, page_timings: List[dict]):
+        with self._lock:
+            entry = self.files[index]
+            entry["vision_seconds"] += seconds
+            entry["vision_pages"] += len(page_timings)
+            entry["vision_calls"] += sum(t["attempts"] for t in page_timings)
+            entry["vision_cache_hits"] += sum(1 for t in page_timings if t["cached"])
+            self.stage_seconds["vision"] += seconds
+
+    def file_finished(self, index: int, error: Optional[str] = None):
+        with self._lock:
+            self.files[index]["status"] = "failed" if error else "loaded"
+            self.files[index]["error"] = error
+            self.files_loaded += 1
+
+    def chunks_split_from(self, source: str, chunks: int, seconds: float):
+        with self._lock:
+            entry = self._by_name.get(source)
+            if entry is not None:
+                entry["chunks"] += chunks
+                entry["split_seconds"] += seconds
+            self.chunks_split += chunks
+            self.stage_seconds["split"] += seconds
+
+    def chunks_indexed_total(self, chunks: int):
+        with self._lock:
+            self.chunks_indexed = chunks
+
+    def progress(self) -> float:
+        """
+        Fraction of the run done: loading (pages extracted, files through the vision pass)
+        weighs 40%, indexing the rest, scaled by how much has been loaded so far.
+        """
+        with self._lock:
+            if self.finished is not None:
+                return 1.0
+            files = len(self.files) or 1
+            load = self.pages_extracted / self.pages_total if self.pages_total else self.files_loaded / files
+            if self.include_visuals:
+                load = (load + self.files_loaded / files) / 2
+            indexed = self.chunks_indexed / self.chunks_split if self.chunks_split else 0.0
+            return min(0.99, 0.4 * load + 0.6 * load * min(1.0, indexed))
+
+    def finish(self, index_stats: dict):
+        with self._lock:
+            self.finished = time.time()
+            self.index_stats = dict(index_stats)
+            self.stage_seconds["embed"] = index_stats.get("embed_seconds", 0.0)
+            self.stage_seconds["upload"] = index_stats.get("upload_seconds", 0.0)
+
+    def estimated_cost(self) -> dict:
+        embedding_tokens = self.index_stats.get("embedding_chars", 0) / 4
+        vision_calls = sum(entry["vision_calls"] for entry in self.files)
+        embedding = embedding_tokens / 1e6 * EMBEDDING_COST_PER_1M_TOKENS
+        vision = vision_calls * VISION_COST_PER_CALL
+        return {
+            "embedding_tokens": int(embedding_tokens),
+            "embedding_usd": embedding,
+            "vision_calls": vision_calls,
+            "vision_usd": vision,
+            "total_usd": embedding + vision,
+        }
+
+    def report(self) -> dict:
+        with self._lock:
+            seconds = (self.finished or time.time()) - self.started
+            stats = self.index_stats
+            return {
+                "started_at": datetime.fromtimestamp(self.started).isoformat(),
+                "seconds": seconds,
+                "pages": self.pages_total,
+                "chunks": self.chunks_split,
+                "vectors": stats.get("points", 0),
+                "skipped": stats.get("skipped", 0),
+                "pages_per_sec": self.pages_total / seconds if seconds else 0.0,
+                "chunks_per_sec": self.chunks_split / seconds if seconds else 0.0,
+                "bytes_uploaded": stats.get("bytes_uploaded", 0),
+                "embedding_calls": stats.get("embedding_calls", 0),
+                "embedding_texts": stats.get("embedding_texts", 0),
+                "vision_calls": sum(entry["vision_calls"] for entry in self.files),
+                "vision_cache_hits": sum(entry["vision_cache_hits"] for entry in self.files),
+                "stage_seconds": dict(self.stage_seconds),
+                "estimated_cost": self.estimated_cost(),
+                "files": [dict(entry) for entry in self.files],
+            }
+
+    def save(self, directory: str = INGEST_REPORT_DIR) -> str:
+        """Writes the report as JSON and returns its path."""
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        path = os.path.join(directory, f"ingest_{datetime.fromtimestamp(self.started).strftime('%Y%m%d-%H%M%S')}_{os.getpid()}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.report(), f, indent=4)
+        return path
@@ -0,0 +1,197 @@
+import os
+import time
+import queue
+import threading
+from typing import Callable, Iterator, List, Optional
+from core.loader import iter_extract_pdfs, process_pdf_images, count_pdf_pages
+from core.ingest_telemetry import IngestTelemetry
+from core.splitter import get_text_splitter
+from core.vector_store import index_documents, delete_source
+
+DOC_QUEUE_SIZE = int(os.getenv("INGEST_DOC_QUEUE_SIZE", "16"))
+CHUNK_QUEUE_SIZE = int(os.getenv("INGEST_CHUNK_QUEUE_SIZE", "256"))
+
+_DONE = object()
+
+
+class _StageError:
+    """Carries an exception from a worker stage to the consumer."""
+
+    def __init__(self, error: Exception):
+        self.error = error
+
+
+def _put(q: queue.Queue, item, stop: threading.Event) -> bool:
+    """Blocking put that gives up once the pipeline is stopped (backpressure with an exit)."""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=0.2)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _drain(q: queue.Queue, stop: threading.Event, poll: Optional[Callable[[], None]] = None) -> Iterator:
+    """
+    Yields items until _DONE. poll, if given, is called between items and every 0.2s
+    while the queue is empty, so the consuming thread can do work while it waits.
+    """
+    while True:
+        if poll is None:
+            item = q.get()
+        else:
+            poll()
+            try:
+                item = q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+        if item is _DONE:
+            return
+        if isinstance(item, _StageError):
+            stop.set()
+            raise item.error
+        yield item
+
+
+def run_ingestion(
+    files: List[tuple],
+    incremental: bool = True,
+    include_visuals: bool = True,
+    chunk_size: int = 1000,
+    chunk_overlap: int = 200,
+    doc_queue_size: int = DOC_QUEUE_SIZE,
+    chunk_queue_size: int = CHUNK_QUEUE_SIZE,
+    progress_callback: Optional[Callable[[str, dict], None]] = None,
+) -> dict:
+    """
+    Streams (file_path, filename[, backend]) tuples through load -> split -> embed -> upsert.
+    Text extraction fans out to a process pool (see iter_extract_pdfs); vision analysis,
+    splitting and indexing follow, with stages handing work on through bounded
+    queues, so a slow downstream stage blocks the upstream one and peak memory is set
+    by the queue sizes rather than the number of files. A file that fails to load is
+    reported and its vision pass skipped. progress_callback(event, info) receives "ingest_started",
+    "pages_extracted", "file_extracted", "file_loaded", "file_failed" and "chunks_indexed" events
+    on the calling thread; every info dict carries the overall "progress" fraction.
+    In incremental mode the points already stored for each file name are deleted first, so
+    re-uploading an edited PDF replaces its chunks instead of adding to them.
+    The returned stats include the telemetry "report" (see IngestTelemetry), which is also
+    saved as JSON ("report_path").
+    """
+    if incremental:
+        for _, filename, *_ in files:
+            delete_source(filename)
+
+    doc_queue = queue.Queue(maxsize=doc_queue_size)
+    chunk_queue = queue.Queue(maxsize=chunk_queue_size)
+    stop = threading.Event()
+    failures = []
+    telemetry = IngestTelemetry(files, include_visuals)
+    telemetry.set_page_counts(count_pdf_pages(files))
+
+    events = queue.Queue()
+
+    # Worker stages only enqueue events; they are delivered on the calling thread
+    # (Streamlit widgets can only be updated from the script thread).
+    def notify(event: str, **info):
+        events.put((event, info))
+
+    def flush_events():
+        while True:
+            try:
+                event, info = events.get_nowait()
+            except queue.Empty:
+                return
+            if progress_callback:
+                progress_callback(event, {**info, "progress": telemetry.progress()})
+
+    def on_indexed(done, total):
+        telemetry.chunks_indexed_total(done)
+        flush_events()
+        if progress_callback:
+            progress_callback("chunks_indexed", {"chunks": done, "progress": telemetry.progress()})
+
+    def load_stage():
+        try:
+            failed = set()
+            for result in iter_extract_pdfs(files):
+                index, filename = result["index"], result["filename"]
+                telemetry.part_extracted(index, result["pages"], result["seconds"])
+                notify("pages_extracted", filename=filename, index=index, pages=result["pages"],
+                       pages_done=telemetry.pages_extracted, pages_total=telemetry.pages_total)
+                if result["error"] and index not in failed:
+                    failed.add(index)
+                    failures.append({"filename": filename, "error": result["error"]})
+                for doc in result["documents"]:
+                    if not _put(doc_queue, doc, stop):
+                        return
+                if not result["file_done"]:
+                    continue
+                if index in failed:
+                    error = result["error"] or "partial extraction"
+                    telemetry.file_finished(index, error)
+                    notify("file_failed", filename=filename, index=index, total=len(files), error=error)
+                    continue
+                notify("file_extracted", filename=filename, index=index, total=len(files))
+                if include_visuals:
+                    page_timings = []
+                    vision_started = time.time()
+                    visual_docs = process_pdf_images(files[index][0], filename, timings=page_timings)
+                    telemetry.vision_done(index, time.time() - vision_started, page_timings)
+                    for doc in visual_docs:
+                        if not _put(doc_queue, doc, stop):
+                            return
+                telemetry.file_finished(index)
+                notify("file_loaded", filename=filename, index=index, total=len(files))
+            _put(doc_queue, _DONE, stop)
+        except Exception as e:
+            _put(doc_queue, _StageError(e), stop)
+
+    def split_stage():
+        try:
+            text_splitter = get_text_splitter(chunk_size, chunk_overlap)
+            for doc in _drain(doc_queue, stop):
+                split_started = time.time()
+                chunks = text_splitter.split_documents([doc])
+                telemetry.chunks_split_from(doc.metadata.get("source"), len(chunks), time.time() - split_started)
+                for chunk in chunks:
+                    if not _put(chunk_queue, chunk, stop):
+                        return
+            _put(chunk_queue, _DONE, stop)
+        except Exception as e:
+            _put(chunk_queue, _StageError(e), stop)
+
+    workers = [
+        threading.Thread(target=load_stage, name="ingest-load", daemon=True),
+        threading.Thread(target=split_stage, name="ingest-split", daemon=True),
+    ]
+    notify("ingest_started", files=len(files), pages=telemetry.pages_total)
+    for worker in workers:
+        worker.start()
+
+    stats = {}
+    try:
+        stats = index_documents(
+            # Delivers extraction and vision events while this thread waits for chunks
+            _drain(chunk_queue, stop, poll=flush_events),
+            incremental=incremental,
+            progress_callback=on_indexed,
+        )
+    finally:
+        stop.set()
+        for worker in workers:
+            worker.join(timeout=5)
+        flush_events()
+        # The report is persisted for failed runs too (with whatever was counted)
+        telemetry.finish(stats)
+        try:
+            report_path = telemetry.save()
+        except Exception as e:
+            report_path = None
+            print(f"DEBUG: Could not save ingest report: {str(e)}")
+
+    stats["files"] = len(files)
+    stats["failures"] = failures
+    stats["report"] = telemetry.report()
+    stats["report_path"] = report_path
+    return stats
@@ -2,15 +2,26 @@ import os
 import io
 import time
 import uuid
+import base64
+import threading
+import multiprocessing
+try:
+    import resource
+except ImportError: # Windows
+    resource = None
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 import tempfile
 import fitz  # PyMuPDF
 import pytesseract
 from PIL import Image
-from typing import List
+from typing import Iterator, List, Optional
 from langchain_core.documents import Document
 from langchain_community.document_loaders import UnstructuredPDFLoader, TextLoader
-from litellm import completion
 from dotenv import load_dotenv
+from core.embedding_scheduler import TokenBucket, is_rate_limit_error
+from core.vision_cache import VisionCache, perceptual_hash
 
 load_dotenv()
 
@@ -24,112 +35,535 @@ if os.name == 'nt' and os.path.exists(TESSERACT_PATH):
 
 GEMINI_API_KEY = os.getenv("GOOGLE_API_KEY")
 IMAGE_MODEL = "gemini/gemini-2.5-flash-lite"
+VISION_MAX_WORKERS = int(os.getenv("VISION_MAX_WORKERS", "4"))
+VISION_REQUESTS_PER_MINUTE = float(os.getenv("VISION_REQUESTS_PER_MINUTE", "30"))
+# Longest side (pixels) of page renders sent to the vision model; larger images are downscaled by the API anyway
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "1536"))
+VISION_IMAGE_FORMAT = os.getenv("VISION_IMAGE_FORMAT", "jpeg").lower() # "jpeg" or "webp"
+VISION_IMAGE_QUALITY = int(os.getenv("VISION_IMAGE_QUALITY", "85"))
 LLM_IMAGE_PROMPT = """Analyze this document page image. 
 1. Describe any charts, graphs, or tables in detail.
 2. If there are images or diagrams, explain what they represent.
 3. If there is text that might be missed by standard OCR (stylized text, handwritten notes), transcribe it.
 Return 'none' if the page contains no significant visual information besides plain text."""
 
-def load_pdf(file_path: str) -> List[Document]:
+# Text extraction backend: "pymupdf" (text layer, OCR fallback per page) or "unstructured"
+PDF_TEXT_BACKEND = os.getenv("PDF_TEXT_BACKEND", "pymupdf").lower()
+# OCR for pages without a text layer: "tesseract", "unstructured" or "none"
+PDF_OCR_FALLBACK = os.getenv("PDF_OCR_FALLBACK", "tesseract").lower()
+MIN_TEXT_LAYER_CHARS = 20
+
+# Parallel text extraction (process pool)
+EXTRACT_MAX_WORKERS = int(os.getenv("EXTRACT_MAX_WORKERS", str(min(4, os.cpu_count() or 1))))
+EXTRACT_PAGES_PER_TASK = int(os.getenv("EXTRACT_PAGES_PER_TASK", "50"))
+EXTRACT_MEMORY_LIMIT_MB = int(os.getenv("EXTRACT_MEMORY_LIMIT_MB", "0")) # 0 = no cap
+# Pages sampled for the body font size of a PDF split into several tasks
+EXTRACT_BODY_SIZE_SAMPLE_PAGES = int(os.getenv("EXTRACT_BODY_SIZE_SAMPLE_PAGES", "100"))
+# Workers are started fresh rather than forked: forking the multi-threaded Streamlit
+# process can copy locks held by other threads into the child and deadlock it
+EXTRACT_START_METHOD = os.getenv("EXTRACT_START_METHOD", "spawn")
+
+VISION_CACHE_SCOPE = VisionCache.make_scope(IMAGE_MODEL, LLM_IMAGE_PROMPT)
+
+_vision_bucket = None
+_vision_cache = None
+_vision_lock = threading.Lock()
+
+def get_vision_rate_limiter() -> TokenBucket:
+    """Process-wide limiter shared by every vision call, across files and sessions."""
+    global _vision_bucket
+    with _vision_lock:
+        if _vision_bucket is None:
+            _vision_bucket = TokenBucket(VISION_REQUESTS_PER_MINUTE / 60.0)
+        return _vision_bucket
+
+def get_vision_cache() -> VisionCache:
+    """Process-wide perceptual-hash cache of page descriptions."""
+    global _vision_cache
+    with _vision_lock:
+        if _vision_cache is None:
+            _vision_cache = VisionCache()
+        return _vision_cache
+
+def load_pdf_unstructured(file_path: str, strategy: str = "fast") -> List[Document]:
     """
     Standard text extraction using Unstructured (fast strategy).
     We use 'fast' here because we handle images separately to save memory.
     """
     loader = UnstructuredPDFLoader(
         file_path,
-        strategy="fast", # Use fast for text to save RAM
+        strategy=strategy, # Use fast for text to save RAM
         extract_images_in_pdf=False,
         infer_table_structure=False,
         chunking_strategy="by_title",
     )
-    return loader.load()
+    docs = loader.load()
+    for doc in docs:
+        doc.metadata["backend"] = f"unstructured_{strategy}"
+    return docs
+
+def _save_page_range(src, start_page: int, end_page: int) -> str:
+    """Writes pages [start_page, end_page) of an open PDF to a temp file and returns its path."""
+    part = fitz.open()
+    part.insert_pdf(src, from_page=start_page, to_page=end_page - 1)
+    fd, part_path = tempfile.mkstemp(suffix=".pdf")
+    os.close(fd)
+    part.save(part_path)
+    part.close()
+    return part_path
+
+def _ocr_page(doc, page) -> List[Document]:
+    """OCR fallback for a page without a text layer, using PDF_OCR_FALLBACK."""
+    page_num = page.number
+    if PDF_OCR_FALLBACK == "tesseract":
+        try:
+            pix = page.get_pixmap(dpi=300, alpha=False)
+            img_pil = Image.frombytes("RGB", (pix.width, pix.height), pix.samples)
+            text = pytesseract.image_to_string(img_pil)
+        except Exception as e:
+            print(f"DEBUG: OCR failed on page {page_num+1}: {str(e)}")
+            return []
+        if not text.strip():
+            return []
+        return [Document(page_content=text.strip(), metadata={"page": page_num + 1, "backend": "tesseract"})]
+    if PDF_OCR_FALLBACK == "unstructured":
+        part_path = _save_page_range(doc, page_num, page_num + 1)
+        try:
+            docs = load_pdf_unstructured(part_path, strategy="ocr_only")
+        finally:
+            os.remove(part_path)
+        for d in docs:
+            d.metadata["page"] = page_num + 1
+        return docs
+    return []
+
+def _body_font_size(pages_dicts) -> float:
+    """Most common font size (weighted by characters) across the given page dicts."""
+    sizes = {}
+    for page_dict in pages_dicts:
+        for block in page_dict["blocks"]:
+            for line in block.get("lines", []):
+                for span in line["spans"]:
+                    size = round(span["size"], 1)
+                    sizes[size] = sizes.get(size, 0) + len(span["text"].strip())
+    return max(sizes, key=sizes.get) if sizes else 0.0
+
+def _document_body_font_size(doc, max_pages: int = EXTRACT_BODY_SIZE_SAMPLE_PAGES) -> float:
+    """Body font size of a whole document, from up to max_pages evenly spaced pages."""
+    samples = min(len(doc), max(max_pages, 1))
+    page_numbers = sorted({i * len(doc) // samples for i in range(samples)})
+    return _body_font_size(
+        doc.load_page(page_num).get_text("dict", flags=fitz.TEXTFLAGS_TEXT) for page_num in page_numbers
+    )
+
+def _is_heading(line: dict, body_size: float) -> bool:
+    spans = [span for span in line["spans"] if span["text"].strip()]
+    text = "".join(span["text"] for span in spans).strip()
+    if not spans or len(text) > 120:
+        return False
+    size = max(span["size"] for span in spans)
+    bold = all(span["flags"] & 16 for span in spans)
+    return size >= body_size * 1.15 or (bold and size >= body_size)
+
+def load_pdf_pymupdf(file_path: str, start_page: int = 0, end_page: Optional[int] = None, body_size: Optional[float] = None) -> List[Document]:
+    """
+    Fast text extraction straight from the PDF text layer with PyMuPDF.
+    Each page is split into sections at heading lines (larger or bold font), mirroring
+    Unstructured's by_title chunking, with `source` (file_path, like Unstructured's
+    loader), `page`, `title` and `backend` metadata.
+    Only pages without a text layer fall back to OCR (see PDF_OCR_FALLBACK).
+    body_size (the font size headings are compared with) defaults to the most common size
+    in the extracted pages; page-range extraction passes the whole document's.
+    """
+    doc = fitz.open(file_path)
+    docs = []
+    try:
+        end_page = len(doc) if end_page is None else end_page
+        pages = [doc.load_page(page_num) for page_num in range(start_page, end_page)]
+        page_dicts = [page.get_text("dict", flags=fitz.TEXTFLAGS_TEXT) for page in pages]
+        if body_size is None:
+            body_size = _body_font_size(page_dicts)
+        title = None
+        for page, page_dict in zip(pages, page_dicts):
+            page_num = page.number
+            sections = []
+            current = []
+            for block in page_dict["blocks"]:
+                for line in block.get("lines", []):
+                    text = "".join(span["text"] for span in line["spans"]).strip()
+                    if not text:
+                        continue
+                    if _is_heading(line, body_size):
+                        if current:
+                            sections.append((title, current))
+                        title, current = text, [text]
+                    else:
+                        current.append(text)
+                if current:
+                    current.append("")  # blank line between blocks
+            if current:
+                sections.append((title, current))
+
+            page_text = "".join("".join(lines) for _, lines in sections).strip()
+            if len(page_text) < MIN_TEXT_LAYER_CHARS:
+                docs.extend(_ocr_page(doc, page))
+                continue
+            for section_title, lines in sections:
+                content = "\n".join(lines).strip()
+                if not content:
+                    continue
+                metadata = {"page": page_num + 1, "backend": "pymupdf"}
+                if section_title:
+                    metadata["title"] = section_title
+                docs.append(Document(page_content=content, metadata=metadata))
+    finally:
+        doc.close()
+    for d in docs:
+        # Also replaces the temp page path set on Unstructured OCR results
+        d.metadata["source"] = file_path
+    return docs
+
+def load_pdf(file_path: str, backend: str = None) -> List[Document]:
+    """
+    Extracts the text of a PDF with the selected backend:
+    "pymupdf" (default, text layer + OCR only where needed) or "unstructured".
+    """
+    backend = backend or PDF_TEXT_BACKEND
+    if backend == "unstructured":
+        return load_pdf_unstructured(file_path)
+    return load_pdf_pymupdf(file_path)
+
+def _init_extract_worker(memory_limit_mb: int):
+    """Caps the address space of an extraction worker so one huge PDF cannot take the app down."""
+    if memory_limit_mb and resource is not None:
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+def _extract_pdf_part(file_path: str, filename: str, start_page: int, end_page: int, page_count: int, backend: str, body_size: Optional[float] = None) -> List[Document]:
+    """Worker task: extracts pages [start_page, end_page) of a PDF with the given backend."""
+    if backend != "unstructured":
+        docs = load_pdf_pymupdf(file_path, start_page, end_page, body_size)
+    elif start_page == 0 and end_page == page_count:
+        docs = load_pdf_unstructured(file_path)
+    else:
+        # Unstructured has no page-range option, so the range is copied to a temp PDF
+        with fitz.open(file_path) as src:
+            part_path = _save_page_range(src, start_page, end_page)
+        try:
+            docs = load_pdf_unstructured(part_path)
+        finally:
+            os.remove(part_path)
+    for doc in docs:
+        doc.metadata["source"] = filename
+        doc.metadata["page_range"] = f"{start_page + 1}-{end_page}"
+    return docs
+
+def _extract_pdf_part_timed(*args):
+    """Pool entry point: (_extract_pdf_part result, seconds spent in the worker)."""
+    started = time.time()
+    docs = _extract_pdf_part(*args)
+    return docs, time.time() - started
+
+def count_pdf_pages(files) -> dict:
+    """Page count per file index for (file_path, filename[, backend]) tuples; unreadable files are left out."""
+    counts = {}
+    for index, entry in enumerate(files):
+        try:
+            with fitz.open(entry[0]) as doc:
+                counts[index] = len(doc)
+        except Exception:
+            continue
+    return counts
+
+def _plan_extract_tasks(files, pages_per_task: int):
+    """
+    Splits each file into page-range tasks. Returns (tasks, parts per file, open errors).
+    A PyMuPDF file split into several tasks gets one body font size for all of them, so
+    heading detection does not change at task boundaries.
+    """
+    tasks, parts, errors = [], {}, {}
+    for index, entry in enumerate(files):
+        file_path, filename = entry[0], entry[1]
+        backend = entry[2] if len(entry) > 2 else PDF_TEXT_BACKEND
+        try:
+            with fitz.open(file_path) as doc:
+                page_count = len(doc)
+                step = pages_per_task if pages_per_task > 0 else max(page_count, 1)
+                body_size = None
+                if backend != "unstructured" and page_count > step:
+                    body_size = _document_body_font_size(doc)
+        except Exception as e:
+            errors[index] = str(e)
+            continue
+        ranges = [(start, min(start + step, page_count)) for start in range(0, page_count, step)] or [(0, 0)]
+        parts[index] = len(ranges)
+        for start, end in ranges:
+            tasks.append((index, file_path, filename, start, end, page_count, backend, body_size))
+    return tasks, parts, errors
+
+def _carry_titles(docs: List[Document], title: Optional[str]) -> Optional[str]:
+    """
+    Gives PyMuPDF sections that precede a part's first heading the title in effect at the
+    end of the previous part. Returns the title in effect at the end of this part.
+    """
+    for doc in docs:
+        if doc.metadata.get("backend") != "pymupdf":
+            continue
+        if "title" in doc.metadata:
+            title = doc.metadata["title"]
+        elif title:
+            doc.metadata["title"] = title
+    return title
+
+def _extract_pool(max_workers: int, memory_limit_mb: int) -> ProcessPoolExecutor:
+    return ProcessPoolExecutor(
+        max_workers=max_workers,
+        mp_context=multiprocessing.get_context(EXTRACT_START_METHOD),
+        initializer=_init_extract_worker,
+        initargs=(memory_limit_mb,),
+    )
+
+def _run_isolated(task, memory_limit_mb: int) -> tuple:
+    """Re-runs one task alone in a fresh single-worker pool, so a crash only affects that task."""
+    with _extract_pool(1, memory_limit_mb) as executor:
+        return executor.submit(_extract_pdf_part_timed, *task[1:]).result()
 
-def process_pdf_images(file_path: str, filename: str) -> List[Document]:
+def iter_extract_pdfs(
+    files: List[tuple],
+    max_workers: int = EXTRACT_MAX_WORKERS,
+    pages_per_task: int = EXTRACT_PAGES_PER_TASK,
+    memory_limit_mb: int = EXTRACT_MEMORY_LIMIT_MB,
+) -> Iterator[dict]:
+    """
+    Extracts text from (file_path, filename[, backend]) tuples on a process pool, splitting PDFs longer
+    than pages_per_task into page ranges. Yields one dict per finished part, as parts complete
+    but in page order within a file (so section titles carry over between parts):
+    {"index", "filename", "documents", "error", "file_done", "pages", "seconds"}. file_done is
+    True on the last part of a file; pages is the part's page count and seconds the worker time. If a worker crashes, the tasks that were in flight are retried one by one
+    in isolation, so only the file that actually crashes is reported as failed.
+    """
+    tasks, parts, errors = _plan_extract_tasks(files, pages_per_task)
+    for index, error in errors.items():
+        yield {"index": index, "filename": files[index][1], "documents": [], "error": error, "file_done": True, "pages": 0, "seconds": 0.0}
+
+    def result(task, timed=None, error=None):
+        parts[task[0]] -= 1
+        documents, seconds = timed or ([], 0.0)
+        return {
+            "index": task[0],
+            "filename": task[2],
+            "documents": documents,
+            "error": error,
+            "file_done": parts[task[0]] == 0,
+            "pages": task[4] - task[3],
+            "seconds": seconds,
+        }
+
+    next_start = {index: 0 for index in parts}
+    held = {}
+    titles = {}
+
+    def release(task, timed=None, error=None):
+        """Holds a finished part until the parts before it in its file have been yielded."""
+        index = task[0]
+        held[(index, task[3])] = (task, timed, error)
+        while (index, next_start[index]) in held:
+            task, timed, error = held.pop((index, next_start[index]))
+            next_start[index] = task[4]
+            if timed:
+                titles[index] = _carry_titles(timed[0], titles.get(index))
+            yield result(task, timed=timed, error=error)
+
+    max_workers = max(1, max_workers)
+    pending = deque(tasks)
+    suspects = []
+    executor = _extract_pool(max_workers, memory_limit_mb)
+    in_flight = {}
+    try:
+        while pending or in_flight:
+            # Bounded submission keeps finished-but-unconsumed results from piling up
+            while pending and len(in_flight) < max_workers * 2:
+                task = pending.popleft()
+                in_flight[executor.submit(_extract_pdf_part_timed, *task[1:])] = task
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            broken = False
+            for future in done:
+                task = in_flight.pop(future)
+                try:
+                    yield from release(task, timed=future.result())
+                except BrokenProcessPool:
+                    broken = True
+                    suspects.append(task)
+                except Exception as e:
+                    yield from release(task, error=str(e))
+            if broken:
+                print("DEBUG: Extraction worker crashed, isolating in-flight tasks...")
+                suspects.extend(in_flight.values())
+                in_flight.clear()
+                executor.shutdown(wait=False, cancel_futures=True)
+                executor = _extract_pool(max_workers, memory_limit_mb)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    for task in suspects:
+        try:
+            yield from release(task, timed=_run_isolated(task, memory_limit_mb))
+        except BrokenProcessPool:
+            yield from release(task, error="Extraction process crashed (out of memory or corrupt PDF).")
+        except Exception as e:
+            yield from release(task, error=str(e))
+
+def _page_has_large_image(page, large_xrefs: dict) -> bool:
+    """
+    Checks the page's image list for a large (> 300x120) image without decoding it:
+    width/height come from the xref's dictionary via get_images(full=True).
+    large_xrefs memoizes xref -> is_large across pages, so images reused on many pages
+    (backgrounds, repeated charts) are sized once but still count on every page.
+    """
+    for img in page.get_images(full=True):
+        xref = img[0]
+        is_large = large_xrefs.get(xref)
+        if is_large is None:
+            is_large = large_xrefs[xref] = img[2] > 300 and img[3] > 120
+        if is_large:
+            return True
+    return False
+
+def _render_page(page, max_side: int = VISION_MAX_SIDE, image_format: str = VISION_IMAGE_FORMAT):
+    """
+    Renders a page for the vision model at the highest DPI (capped at 200) whose longest
+    side fits max_side pixels, encoding straight from the pixmap samples.
+    Returns (data URL, width, height, perceptual hash).
+    """
+    longest = max(page.rect.width, page.rect.height) or 1
+    dpi = max(36, min(200, int(72 * max_side / longest)))
+    page_pix = page.get_pixmap(dpi=dpi, alpha=False)
+    img_pil = Image.frombytes("RGB", (page_pix.width, page_pix.height), page_pix.samples)
+    if image_format == "webp":
+        buffered = io.BytesIO()
+        img_pil.save(buffered, format="WEBP", quality=VISION_IMAGE_QUALITY)
+        data, mime = buffered.getvalue(), "image/webp"
+    else:
+        data, mime = page_pix.tobytes("jpeg", jpg_quality=VISION_IMAGE_QUALITY), "image/jpeg"
+    phash = perceptual_hash(img_pil)
+    image_url = f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}"
+    return image_url, page_pix.width, page_pix.height, phash
+
+def _describe_page(image_url: str, page_num: int, bucket: TokenBucket, max_retries: int = 2):
+    """Sends one rendered page to the vision model. Returns (description, attempts)."""
+    # Imported here so spawned extraction workers, which re-import this module, skip litellm
+    from litellm import completion
+
+    for retry in range(max_retries):
+        bucket.acquire()
+        try:
+            llm_response = completion(
+                model=IMAGE_MODEL,
+                api_key=GEMINI_API_KEY,
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {"type": "text", "text": LLM_IMAGE_PROMPT},
+                            {"type": "image_url", "image_url": {"url": image_url}}
+                        ]
+                    }
+                ]
+            )
+            bucket.reward()
+            return llm_response['choices'][0]['message']['content'], retry + 1
+        except Exception as e:
+            print(f"DEBUG: Page {page_num+1} analysis failed: {str(e)}")
+            if is_rate_limit_error(e):
+                bucket.penalize()
+            time.sleep(2 ** (retry + 1))
+    return None, max_retries
+
+def _analyze_page(image_url: str, page_num: int, bucket: TokenBucket, phash: int):
+    started = time.time()
+    description, attempts = _describe_page(image_url, page_num, bucket)
+    if description is not None:
+        # 'none' answers are cached too, so text-only pages are not re-sent either
+        get_vision_cache().put(VISION_CACHE_SCOPE, phash, description)
+    return description, attempts, time.time() - started
+
+def process_pdf_images(file_path: str, filename: str, max_workers: int = VISION_MAX_WORKERS, timings: Optional[list] = None) -> List[Document]:
     """
     User-requested logic: Process images in a PDF, generate descriptions via LLM.
-    Returns a list of Documents containing the descriptions.
+    Candidate pages are rendered on the calling thread (PyMuPDF documents are not
+    thread-safe) and analyzed by a bounded worker pool sharing one rate limiter.
+    Pages whose render matches a cached one (perceptual hash) reuse its description.
+    Returns a list of Documents containing the descriptions, in page order.
+    If a timings list is given, one entry per analyzed page is appended to it.
     """
     if not GEMINI_API_KEY:
         print("DEBUG: GOOGLE_API_KEY not found. Skipping image analysis.")
         return []
 
     doc = fitz.open(file_path)
-    image_docs = []
-    
+    bucket = get_vision_rate_limiter()
+    cache = get_vision_cache()
+    results = {}
+    started = time.time()
+
     print(f"DEBUG: Processing PDF '{filename}' for visual content ({len(doc)} pages)...")
-    
-    for page_num in range(len(doc)):
-        page = doc.load_page(page_num)
-        image_list = page.get_images(full=True)
-        
-        has_large_image = False
-        if image_list:
-            for img in image_list:
-                xref = img[0]
-                try:
-                    pix = fitz.Pixmap(doc, xref)
-                    if pix.width > 300 and pix.height > 120:
-                        has_large_image = True
-                        break
-                    pix = None # Clear memory
-                except Exception:
+
+    def collect(future, page_num, width, height, render_seconds):
+        description, attempts, llm_seconds = future.result()
+        if timings is not None:
+            timings.append({
+                "page": page_num + 1,
+                "render_seconds": render_seconds,
+                "llm_seconds": llm_seconds,
+                "attempts": attempts,
+                "cached": attempts == 0,
+            })
+        if description and description.strip().lower() != "none" and len(description) > 20:
+            print(f"DEBUG: Page {page_num+1}: Description generated.")
+            results[page_num] = Document(
+                page_content=f"[Visual Content Description for Page {page_num+1}]: {description}",
+                metadata={
+                    "source": filename,
+                    "page": page_num + 1,
+                    "content_type": "image_description",
+                    "dimensions": f"{width}x{height}"
+                }
+            )
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            in_flight = []
+            large_xrefs = {}
+            for page_num in range(len(doc)):
+                page = doc.load_page(page_num)
+                if not _page_has_large_image(page, large_xrefs):
                     continue
-        
-        if has_large_image:
-            print(f"DEBUG: Page {page_num+1}: Potential visual content detected. Analyzing...")
-            
-            # Render page as image for LLM
-            page_pix = page.get_pixmap(dpi=200) # Lower DPI to save memory/upload time
-            img_pil = Image.open(io.BytesIO(page_pix.tobytes("png")))
-            
-            # Convert to base64 for LiteLLM
-            buffered = io.BytesIO()
-            img_pil.save(buffered, format="PNG", optimize=True)
-            import base64
-            img_base64 = base64.b64encode(buffered.getvalue()).decode('utf-8')
-            
-            description = None
-            max_retries = 2
-            for retry in range(max_retries):
-                try:
-                    llm_response = completion(
-                        model=IMAGE_MODEL,
-                        api_key=GEMINI_API_KEY,
-                        messages=[
-                            {
-                                "role": "user",
-                                "content": [
-                                    {"type": "text", "text": LLM_IMAGE_PROMPT},
-                                    {"type": "image_url", "image_url": {"url": f"data:image/png;base64,{img_base64}"}}
-                                ]
-                            }
-                        ]
-                    )
-                    description = llm_response['choices'][0]['message']['content']
-                    break
-                except Exception as e:
-                    print(f"DEBUG: Page {page_num+1} analysis failed: {str(e)}")
-                    time.sleep(2 ** (retry + 1))
-            
-            if description and description.strip().lower() != "none" and len(description) > 20:
-                print(f"DEBUG: Page {page_num+1}: Description generated.")
-                image_docs.append(Document(
-                    page_content=f"[Visual Content Description for Page {page_num+1}]: {description}",
-                    metadata={
-                        "source": filename,
-                        "page": page_num + 1,
-                        "content_type": "image_description",
-                        "dimensions": f"{img_pil.width}x{img_pil.height}"
-                    }
-                ))
-            
-            # Memory cleanup
-            page_pix = None
-            img_pil = None
-            buffered = None
-
-    doc.close()
-    return image_docs
+
+                print(f"DEBUG: Page {page_num+1}: Potential visual content detected. Analyzing...")
+                render_started = time.time()
+                image_url, width, height, phash = _render_page(page)
+                render_seconds = time.time() - render_started
+
+                cached = cache.get(VISION_CACHE_SCOPE, phash)
+                if cached is not None:
+                    print(f"DEBUG: Page {page_num+1}: Reusing cached description.")
+                    future = Future()
+                    future.set_result((cached, 0, 0.0))
+                    collect(future, page_num, width, height, render_seconds)
+                    continue
+
+                # Bound the number of rendered pages held in memory
+                if len(in_flight) >= max_workers * 2:
+                    collect(*in_flight.pop(0))
+                future = executor.submit(_analyze_page, image_url, page_num, bucket, phash)
+                in_flight.append((future, page_num, width, height, render_seconds))
+            for item in in_flight:
+                collect(*item)
+    finally:
+        doc.close()
+
+    print(f"DEBUG: Visual analysis of '{filename}' took {time.time() - started:.1f}s ({len(results)} pages described).")
+    return [results[page_num] for page_num in sorted(results)]
 
 def load_txt(file_path: str) -> List[Document]:
     """Loads a text file."""
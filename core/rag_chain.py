@@ -2,11 +2,119 @@ from langchain_google_genai import ChatGoogleGenerativeAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.runnables import RunnablePassthrough
-from core.vector_store import load_vector_store
+from langchain_core.retrievers import BaseRetriever
+from langchain_core.documents import Document
+from core.vector_store import load_vector_store, get_cached_resource, get_sparse_index, rebuild_sparse_index, get_embeddings_model, get_collection_version, COLLECTION_NAME, QDRANT_URL, EMBEDDING_MODEL
+from core.answer_cache import SemanticAnswerCache, ANSWER_CACHE_ENABLED
+from core.reformulation import QuestionReformulator, same_question
+from core.context_budget import ContextBudget, count_tokens
+from core.reranker import Reranker, RERANK_ENABLED, RERANK_CANDIDATES
+from core.collection_profiles import get_collection_profile
+from core.tracing import Trace
 from langchain_core.prompts import MessagesPlaceholder
-from langchain_core.messages import HumanMessage, AIMessage
-from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-import time
+from tenacity import retry, stop_after_attempt, wait_exponential
+import os
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+LLM_MODEL = "gemini-2.5-flash-lite"
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+RETRIEVER_K = 5
+SPECULATIVE_RETRIEVAL = os.getenv("SPECULATIVE_RETRIEVAL", "true").lower() == "true"
+
+# Shared pool so the dense and sparse legs of every query run concurrently
+_retrieval_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="retrieval")
+# Speculative retrievals get their own pool: each one runs HybridRetriever, which waits
+# on legs queued in _retrieval_executor, so sharing that bounded pool could deadlock it
+_speculative_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="speculative")
+
+def get_llm(model: str = LLM_MODEL, temperature: float = 0):
+    """Returns the shared chat model for the given model name and temperature."""
+    return get_cached_resource(
+        "llm",
+        (model, temperature),
+        lambda: ChatGoogleGenerativeAI(model=model, temperature=temperature),
+    )
+
+def _doc_key(doc: Document) -> str:
+    return str(doc.metadata.get("_id") or hashlib.sha256(doc.page_content.encode("utf-8")).hexdigest())
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], k: int, rrf_k: int = 60) -> List[Document]:
+    """Fuses ranked lists with RRF (score = sum of 1 / (rrf_k + rank)) and returns the top k."""
+    scores = {}
+    docs = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results):
+            key = _doc_key(doc)
+            scores[key] = scores.get(key, 0.0) + 1.0 / (rrf_k + rank + 1)
+            if key in docs:
+                # Keep the richest metadata seen for the chunk
+                merged = dict(docs[key].metadata)
+                merged.update({m: v for m, v in doc.metadata.items() if v is not None})
+                docs[key] = Document(page_content=docs[key].page_content, metadata=merged)
+            else:
+                docs[key] = doc
+    ranked = sorted(scores, key=scores.get, reverse=True)[:k]
+    return [docs[key] for key in ranked]
+
+class HybridRetriever(BaseRetriever):
+    """
+    Dense (Qdrant) + sparse (BM25) retriever. Both legs fetch fetch_k candidates
+    concurrently and are fused with reciprocal rank fusion, so exact-term queries
+    ("Table 4", "Figure 15") surface even when their embeddings rank low.
+    """
+
+    vector_store: Any
+    sparse_index: Any
+    k: int = RETRIEVER_K
+    fetch_k: int = 20
+    rrf_k: int = 60
+    search_params: Any = None  # collection profile's models.SearchParams (HNSW ef, quantization rescoring)
+
+    def _sparse_search(self, query: str) -> List[Document]:
+        try:
+            return [
+                Document(page_content=text, metadata={**metadata, "_id": point_id})
+                for point_id, _, text, metadata in self.sparse_index.search(query, self.fetch_k)
+            ]
+        except Exception as e:
+            print(f"DEBUG: Sparse search failed, using dense results only: {str(e)}")
+            return []
+
+    def _get_relevant_documents(self, query: str, *, run_manager=None) -> List[Document]:
+        dense_future = _retrieval_executor.submit(
+            self.vector_store.similarity_search, query, k=self.fetch_k, search_params=self.search_params
+        )
+        sparse_future = _retrieval_executor.submit(self._sparse_search, query)
+        return reciprocal_rank_fusion([dense_future.result(), sparse_future.result()], self.k, self.rrf_k)
+
+def get_answer_cache():
+    """Returns the shared semantic answer cache."""
+    return get_cached_resource("answer_cache", (), SemanticAnswerCache)
+
+def get_reranker():
+    """Returns the shared re-ranker (loads the cross-encoder once when RERANK_MODEL is set)."""
+    return get_cached_resource("reranker", (), Reranker)
+
+def get_retriever(vector_store, k: int = RETRIEVER_K):
+    """
+    Returns the hybrid BM25 + dense retriever (or plain dense when HYBRID_SEARCH=false),
+    searching with the collection profile's search params.
+    """
+    search_params = get_collection_profile().search_params()
+    if not HYBRID_SEARCH:
+        search_kwargs = {"k": k}
+        if search_params is not None:
+            search_kwargs["search_params"] = search_params
+        return vector_store.as_retriever(search_kwargs=search_kwargs)
+    sparse_index = get_sparse_index()
+    if sparse_index.count() == 0:
+        # Local index missing (fresh deployment): rebuild it from the Qdrant payloads
+        rebuild_sparse_index()
+    return HybridRetriever(
+        vector_store=vector_store, sparse_index=sparse_index, k=k, fetch_k=max(20, k), search_params=search_params
+    )
 
 def format_docs(docs):
     """Formats a list of documents into a single string for context."""
@@ -17,10 +125,10 @@ def get_rag_chain(persist_directory: str = "faiss_db"):
     
     # 1. Load the vector store and set up the retriever
     vector_store = load_vector_store(persist_directory)
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
+    retriever = get_retriever(vector_store)
 
     # 2. Define the LLM (using the verified Gemini model)
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0)
+    llm = get_llm()
 
     # 3. Define the RAG Prompt
     template = """You are an AI Knowledge Assistant. Use the following pieces of retrieved context to answer the question. 
@@ -52,8 +160,8 @@ def get_rag_chain_with_sources(persist_directory: str = "faiss_db"):
     This uses a more manual approach to return sources.
     """
     vector_store = load_vector_store(persist_directory)
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0)
+    retriever = get_retriever(vector_store)
+    llm = get_llm()
 
     template = """You are an AI Knowledge Assistant. Use the following pieces of retrieved context to answer the question. 
 If you don't know the answer, just say that you don't know, don't try to make up an answer.
@@ -91,8 +199,8 @@ def get_rag_chain_with_memory(persist_directory: str = "faiss_db"):
     Creates a RAG chain that handles conversation history.
     """
     vector_store = load_vector_store(persist_directory)
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0)
+    retriever = get_retriever(vector_store)
+    llm = get_llm()
 
     # Contextualize question prompt
     # This helps in handling follow-up questions by re-writing them based on history
@@ -143,94 +251,297 @@ Context:
     )
 
     return rag_chain
+
 def get_rag_chain_with_memory_and_sources(persist_directory: str = "faiss_db"):
     """
-    Creates a RAG chain that handles conversation history AND returns sources.
+    Returns the shared memory-and-sources chain for the current config.
+    Built once per process, so reruns skip client construction and TLS handshakes.
     """
-    vector_store = load_vector_store(persist_directory)
-    retriever = vector_store.as_retriever(search_kwargs={"k": 5})
-    llm = ChatGoogleGenerativeAI(model="gemini-2.5-flash-lite", temperature=0)
+    return get_memory_rag_pipeline().invoke
 
-    # 1. Contextualize Question
-    contextualize_q_system_prompt = """Given a chat history and the latest user question \
+def get_streaming_rag_chain_with_memory_and_sources(persist_directory: str = "faiss_db"):
+    """
+    Streaming variant of get_rag_chain_with_memory_and_sources. The returned function
+    yields {"type": "sources"} once retrieval is done, then {"type": "token"} events as
+    the LLM produces them, and finally {"type": "done"} with the full result.
+    """
+    return get_memory_rag_pipeline().stream
+
+def get_memory_rag_pipeline():
+    """Returns the shared MemoryRagPipeline behind both chain variants."""
+    return get_cached_resource(
+        "rag_chain",
+        (QDRANT_URL, COLLECTION_NAME, EMBEDDING_MODEL, LLM_MODEL),
+        MemoryRagPipeline,
+    )
+
+chain_retry = retry(
+    stop=stop_after_attempt(5),
+    wait=wait_exponential(multiplier=1, min=2, max=15),
+)
+
+class MemoryRagPipeline:
+    """
+    RAG chain that handles conversation history AND returns sources.
+    Prompt size is bounded by ContextBudget: recent turns are kept verbatim, older ones
+    are summarized, and retrieved chunks are packed to a token budget (reported as "budget").
+    Answers are cached per standalone question (see get_answer_cache); since the cache key
+    is the rewritten question, follow-ups that resolve to the same question share an answer.
+    With RERANK=true, retrieval over-fetches RERANK_CANDIDATES chunks and the Reranker
+    narrows them down to RERANK_TOP_N.
+    """
+
+    def __init__(self):
+        vector_store = load_vector_store()
+        self.embeddings = get_embeddings_model()
+        self.answer_cache = get_answer_cache() if ANSWER_CACHE_ENABLED else None
+        self.reranker = get_reranker() if RERANK_ENABLED else None
+        self.retrieve_k = RERANK_CANDIDATES if self.reranker is not None else RETRIEVER_K
+        self.retriever = get_retriever(vector_store, k=self.retrieve_k)
+        llm = get_llm()
+
+        # 1. Contextualize Question
+        contextualize_q_system_prompt = """Given a chat history and the latest user question \
 which might reference context in the chat history, formulate a standalone question \
 which can be understood without the chat history. Do NOT answer the question, \
 just reformulate it if needed and otherwise return it as is."""
-    
-    contextualize_q_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", contextualize_q_system_prompt),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{question}"),
-        ]
-    )
-    contextualize_q_chain = contextualize_q_prompt | llm | StrOutputParser()
 
-    # 2. QA Prompt
-    qa_system_prompt = """You are an AI Knowledge Assistant. Use the following pieces of retrieved context to answer the question. \
+        contextualize_q_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", contextualize_q_system_prompt),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("human", "{question}"),
+            ]
+        )
+        self.reformulator = QuestionReformulator(contextualize_q_prompt | llm | StrOutputParser())
+
+        # 2. QA Prompt
+        qa_system_prompt = """You are an AI Knowledge Assistant. Use the following pieces of retrieved context to answer the question. \
 If you don't know the answer, just say that you don't know, don't try to make up an answer. \
 Keep the answer concise and professional.
 
+Earlier in this conversation:
+{history_summary}
+
 Context:
 {context}"""
 
-    qa_prompt = ChatPromptTemplate.from_messages(
-        [
-            ("system", qa_system_prompt),
-            MessagesPlaceholder(variable_name="chat_history"),
-            ("human", "{question}"),
-        ]
-    )
-    
-    qa_chain = qa_prompt | llm | StrOutputParser()
+        qa_prompt = ChatPromptTemplate.from_messages(
+            [
+                ("system", qa_system_prompt),
+                MessagesPlaceholder(variable_name="chat_history"),
+                ("human", "{question}"),
+            ]
+        )
+        self.qa_chain = qa_prompt | llm | StrOutputParser()
+        self.budget = ContextBudget()
 
-    # 3. Custom Invoke Function with Robust Retry Logic
-    @retry(
-        stop=stop_after_attempt(5),
-        wait=wait_exponential(multiplier=1, min=2, max=15),
-    )
-    def invoke_chain(input_data):
-        question = input_data["question"]
-        chat_history = input_data.get("chat_history", [])
-        
-        standalone_question = question
-        # Reformulate question if history exists
-        if chat_history:
+    def _retrieve(self, state: dict, speculative=None):
+        """
+        Retrieves docs for the standalone question. speculative is a future holding the
+        results for the raw question (started while the rewrite was running): it is used
+        as-is when the rewrite did not change the question, and fused with the rewritten
+        query's results otherwise.
+        """
+        raw_docs = None
+        if speculative is not None:
             try:
-                standalone_question = contextualize_q_chain.invoke({
-                    "chat_history": chat_history,
-                    "question": question
-                })
-                # If AI returned something empty or invalid, fallback
-                if not standalone_question or len(standalone_question.strip()) < 2:
-                    standalone_question = question
-            except Exception:
-                standalone_question = question
-            
+                raw_docs = speculative.result()
+            except Exception as e:
+                print(f"DEBUG: Speculative retrieval failed: {str(e)}")
+        if raw_docs is not None and same_question(state["standalone_question"], state["question"]):
+            return raw_docs
+
         # Retrieve docs (Embedding call happens here)
         try:
-            docs = retriever.invoke(standalone_question)
+            docs = self.retriever.invoke(state["standalone_question"])
         except Exception as e:
-            # If the reformulated question crashes the embedding engine, 
-            # try one last time with the raw original question
-            if chat_history:
-                docs = retriever.invoke(question)
-            else:
-                raise e
-                
-        context = format_docs(docs)
-        
-        # Generate Answer
-        answer = qa_chain.invoke({
-            "context": context,
+            # If the reformulated question crashes the embedding engine,
+            # fall back to the raw original question
+            if raw_docs is not None:
+                return raw_docs
+            if state["chat_history"]:
+                return self.retriever.invoke(state["question"])
+            raise e
+        if raw_docs:
+            return reciprocal_rank_fusion([docs, raw_docs], self.retrieve_k)
+        return docs
+
+    def _prepare(self, input_data: dict, trace: Trace):
+        """Rewrite, answer-cache lookup and retrieval. Returns (state, docs); docs is None on a cache hit."""
+        question = input_data["question"]
+        budget = {}
+        with trace.span("history") as span:
+            chat_history, history_summary = self.budget.trim_history(input_data.get("chat_history", []), budget)
+            span.set(messages=budget["history_messages"], summarized=budget["summarized_messages"])
+
+        # Only follow-ups that look context-dependent pay for the rewrite LLM call;
+        # meanwhile the raw question is retrieved speculatively.
+        with trace.span("rewrite") as span:
+            standalone_question, rewrite = self.reformulator.plan(question, chat_history)
+            speculative = None
+            if standalone_question is None:
+                if SPECULATIVE_RETRIEVAL:
+                    speculative = _speculative_executor.submit(self.retriever.invoke, question)
+                standalone_question = self.reformulator.rewrite(question, chat_history)
+            span.set(outcome=rewrite, speculative=speculative is not None)
+
+        state = {
+            "question": question,
             "chat_history": chat_history,
-            "question": question
-        })
-        
+            "history_summary": history_summary,
+            "budget": budget,
+            "standalone_question": standalone_question,
+            "rewrite": rewrite,
+            "query_vector": None,
+            "version": get_collection_version(),
+            "cached": None,
+        }
+
+        # Embedded up front so the call is timed on its own; the retriever and the
+        # answer cache then reuse the vector through the embedding cache.
+        try:
+            with trace.span("embedding"):
+                state["query_vector"] = self.embeddings.embed_query(state["standalone_question"])
+        except Exception as e:
+            print(f"DEBUG: Query embedding failed, retrying in retrieval: {str(e)}")
+
+        # Semantic answer cache
+        if self.answer_cache is not None and state["query_vector"] is not None:
+            try:
+                with trace.span("answer_cache") as span:
+                    state["cached"] = self.answer_cache.lookup(state["query_vector"], state["version"])
+                    span.set(hit=state["cached"] is not None)
+                if state["cached"] is not None:
+                    return state, None
+            except Exception as e:
+                print(f"DEBUG: Answer cache lookup skipped: {str(e)}")
+
+        with trace.span("retrieval") as span:
+            docs = self._retrieve(state, speculative)
+            span.set(chunks=len(docs))
+        if self.reranker is not None:
+            with trace.span("rerank") as span:
+                rerank = {}
+                docs = self.reranker.rerank(state["standalone_question"], docs, rerank)
+                span.set(chunks=len(docs), **rerank)
+        return state, docs
+
+    def _qa_input(self, state: dict, docs) -> dict:
         return {
+            "context": format_docs(self.budget.pack_documents(docs, state["budget"])),
+            "chat_history": state["chat_history"],
+            "history_summary": state["history_summary"] or "(none)",
+            "question": state["question"]
+        }
+
+    def _traced_qa_input(self, state: dict, docs, trace: Trace) -> dict:
+        with trace.span("context") as span:
+            qa_input = self._qa_input(state, docs)
+            span.set(chunks=state["budget"]["chunks_used"], tokens=state["budget"]["context_tokens"])
+        return qa_input
+
+    @staticmethod
+    def _prompt_tokens(state: dict, qa_input: dict) -> int:
+        return (
+            count_tokens(qa_input["context"]) + count_tokens(qa_input["history_summary"])
+            + state["budget"]["history_tokens"] + count_tokens(qa_input["question"])
+        )
+
+    def _finish(self, state: dict, docs, answer: str) -> dict:
+        result = {
             "answer": answer,
             "sources": list(set([doc.metadata.get("source", "Unknown") for doc in docs])),
             "chunks": [doc.page_content for doc in docs]
         }
+        if self.answer_cache is not None and state["query_vector"] is not None:
+            self.answer_cache.store(state["query_vector"], state["version"], result)
+        return {**result, "cached": False, "budget": state["budget"]}
 
-    return invoke_chain
+    @staticmethod
+    def _with_retries(trace: Trace, fn, *args):
+        """Runs fn under chain_retry, recording every attempt as an "attempt" span."""
+        attempts = [0]
+
+        def attempt():
+            attempts[0] += 1
+            with trace.span("attempt", number=attempts[0]):
+                return fn(*args)
+
+        try:
+            return chain_retry(attempt)()
+        finally:
+            trace.set(attempts=attempts[0])
+
+    def _invoke_once(self, input_data: dict, trace: Trace) -> dict:
+        state, docs = self._prepare(input_data, trace)
+        if state["cached"] is not None:
+            return {**state["cached"], "cached": True, "budget": state["budget"]}
+        qa_input = self._traced_qa_input(state, docs, trace)
+        # Generate Answer
+        with trace.span("generation") as span:
+            answer = self.qa_chain.invoke(qa_input)
+            span.set(prompt_tokens=self._prompt_tokens(state, qa_input), completion_tokens=count_tokens(answer))
+        return self._finish(state, docs, answer)
+
+    def invoke(self, input_data: dict) -> dict:
+        """
+        Answers a question. The result also carries "timings" (ms per stage) and "trace_id";
+        the trace is exported to the sinks configured in core.tracing.
+        """
+        trace = Trace("rag.invoke")
+        try:
+            result = self._with_retries(trace, self._invoke_once, input_data, trace)
+        except Exception as e:
+            trace.finish(e)
+            raise
+        trace.set(cached=result["cached"])
+        trace.finish()
+        return {**result, "timings": trace.breakdown(), "trace_id": trace.trace_id}
+
+    __call__ = invoke
+
+    def stream(self, input_data: dict):
+        """
+        Yields sources first, then answer tokens as they arrive, then the full result.
+        Only the steps before the first token are retried; a stream cannot be replayed.
+        """
+        trace = Trace("rag.stream")
+        try:
+            state, docs = self._with_retries(trace, self._prepare, input_data, trace)
+            if state["cached"] is not None:
+                cached = state["cached"]
+                trace.set(cached=True)
+                trace.finish()
+                yield {"type": "sources", "sources": cached["sources"], "chunks": cached["chunks"]}
+                yield {"type": "token", "text": cached["answer"]}
+                yield {"type": "done", **cached, "cached": True, "budget": state["budget"], "timings": trace.breakdown(), "trace_id": trace.trace_id}
+                return
+
+            qa_input = self._traced_qa_input(state, docs, trace)
+            yield {
+                "type": "sources",
+                "sources": list(set([doc.metadata.get("source", "Unknown") for doc in docs])),
+                "chunks": [doc.page_content for doc in docs],
+            }
+            parts = []
+            with trace.span("generation") as span:
+                for token in self.qa_chain.stream(qa_input):
+                    if not parts:
+                        span.set(first_token_ms=span.elapsed() * 1000)
+                    parts.append(token)
+                    yield {"type": "token", "text": token}
+                answer = "".join(parts)
+                span.set(prompt_tokens=self._prompt_tokens(state, qa_input), completion_tokens=count_tokens(answer))
+            result = self._finish(state, docs, answer)
+            trace.set(cached=False)
+            trace.finish()
+            yield {"type": "done", **result, "timings": trace.breakdown(), "trace_id": trace.trace_id}
+        except GeneratorExit:
+            # Consumer stopped reading (e.g. the Streamlit script was interrupted)
+            trace.set(cancelled=True)
+            trace.finish()
+            raise
+        except Exception as e:
+            trace.finish(e)
+            raise
@@ -0,0 +1,133 @@
+import os
+import re
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+
+REWRITE_CACHE_SIZE = int(os.getenv("REWRITE_CACHE_SIZE", "1024"))
+# "heuristic" skips the rewrite for self-contained follow-ups, "always" rewrites every follow-up
+REWRITE_MODE = os.getenv("REWRITE_MODE", "heuristic").lower()
+
+# Words that usually point back into the conversation
+ANAPHORA = frozenset(
+    "it its it's this that these those they them their theirs he him his she her "
+    "above previous earlier former latter same such there".split()
+)
+CONTINUATION_PREFIXES = ("and ", "also ", "what about", "how about", "more ", "tell me more", "why", "elaborate", "explain further", "continue")
+WORD_RE = re.compile(r"[a-z']+")
+
+
+def needs_rewrite(question: str, chat_history: list) -> bool:
+    """
+    Cheap check for whether a follow-up depends on the conversation: pronouns and
+    other back-references, continuation phrases, or questions too short to stand alone.
+    """
+    if not chat_history:
+        return False
+    text = question.strip().lower()
+    words = WORD_RE.findall(text)
+    if len(words) <= 3:
+        return True
+    if text.startswith(CONTINUATION_PREFIXES):
+        return True
+    return any(word in ANAPHORA for word in words)
+
+
+def history_key(chat_history: list, question: str) -> str:
+    digest = hashlib.sha256()
+    for message in chat_history:
+        digest.update(type(message).__name__.encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(str(message.content).encode("utf-8"))
+        digest.update(b"\0")
+    digest.update(question.strip().encode("utf-8"))
+    return digest.hexdigest()
+
+
+def same_question(a: str, b: str) -> bool:
+    return WORD_RE.findall(a.lower()) == WORD_RE.findall(b.lower())
+
+
+class QuestionReformulator:
+    """
+    Decides whether a follow-up question must be rewritten by the LLM and caches
+    rewrites per (chat history, question). Counts how each question was handled:
+    no_history, skipped (heuristic), cached, rewritten, failed.
+    """
+
+    def __init__(self, contextualize_q_chain, cache_size: int = REWRITE_CACHE_SIZE):
+        self.contextualize_q_chain = contextualize_q_chain
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.counts = {"no_history": 0, "skipped": 0, "cached": 0, "rewritten": 0, "failed": 0}
+
+    def _count(self, outcome: str):
+        with self._lock:
+            self.counts[outcome] += 1
+
+    def plan(self, question: str, chat_history: list):
+        """
+        Returns (standalone_question, outcome) when no LLM call is needed,
+        or (None, "rewrite") when rewrite() must be called.
+        """
+        if not chat_history:
+            self._count("no_history")
+            return question, "no_history"
+        if REWRITE_MODE != "always" and not needs_rewrite(question, chat_history):
+            self._count("skipped")
+            return question, "skipped"
+        with self._lock:
+            key = history_key(chat_history, question)
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                self.counts["cached"] += 1
+                return self._cache[key], "cached"
+        return None, "rewrite"
+
+    def rewrite(self, question: str, chat_history: list) -> str:
+        """Calls the LLM; falls back to the raw question on empty output or errors."""
+        try:
+            standalone_question = self.contextualize_q_chain.invoke({
+                "chat_history": chat_history,
+                "question": question
+            })
+        except Exception:
+            self._count("failed")
+            return question
+        return self._accept(question, chat_history, standalone_question)
+
+    async def arewrite(self, question: str, chat_history: list, timeout: float = None) -> str:
+        """Async rewrite; a timeout is handled like an LLM error (the raw question is used)."""
+        try:
+            standalone_question = await asyncio.wait_for(
+                self.contextualize_q_chain.ainvoke({
+                    "chat_history": chat_history,
+                    "question": question
+                }),
+                timeout,
+            )
+        except Exception:
+            self._count("failed")
+            return question
+        return self._accept(question, chat_history, standalone_question)
+
+    def _accept(self, question: str, chat_history: list, standalone_question: str) -> str:
+        # If AI returned something empty or invalid, fallback
+        if not standalone_question or len(standalone_question.strip()) < 2:
+            self._count("failed")
+            return question
+        with self._lock:
+            self.counts["rewritten"] += 1
+            self._cache[history_key(chat_history, question)] = standalone_question
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return standalone_question
+
+    def stats(self) -> dict:
+        with self._lock:
+            counts = dict(self.counts)
+        followups = counts["skipped"] + counts["cached"] + counts["rewritten"] + counts["failed"]
+        counts["skip_rate"] = (counts["skipped"] + counts["cached"]) / followups if followups else 0.0
+        return counts
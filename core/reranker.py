@@ -0,0 +1,180 @@
+import os
+import time
+import threading
+from typing import List, Optional
+import numpy as np
+from langchain_core.documents import Document
+from core.sparse_index import tokenize
+
+RERANK_ENABLED = os.getenv("RERANK", "false").lower() == "true"
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "40"))
+RERANK_TOP_N = int(os.getenv("RERANK_TOP_N", "4"))
+# 1.0 = pure relevance, lower values favour chunks that differ from those already picked
+RERANK_MMR_LAMBDA = float(os.getenv("RERANK_MMR_LAMBDA", "0.7"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "200"))
+RERANK_MAX_CONCURRENT = int(os.getenv("RERANK_MAX_CONCURRENT", "4"))
+# Empty = lexical scorer; otherwise a sentence-transformers cross-encoder, e.g. "cross-encoder/ms-marco-MiniLM-L-6-v2"
+RERANK_MODEL = os.getenv("RERANK_MODEL", "")
+CROSS_ENCODER_BATCH_SIZE = 16
+# Share of the fused retrieval rank kept in the relevance score
+PRIOR_WEIGHT = 0.3
+
+
+def _minmax(values: np.ndarray) -> np.ndarray:
+    low, high = values.min(), values.max()
+    return (values - low) / (high - low) if high > low else np.ones_like(values)
+
+
+def _term_matrices(query: str, texts: List[str], k1: float = 1.5, b: float = 0.75):
+    """
+    BM25 scores of the candidates against the query (IDF taken over the candidate set)
+    and their row-normalized TF-IDF vectors, for redundancy between candidates.
+    """
+    vocabulary = {}
+    rows = []
+    for text in texts:
+        counts = {}
+        for token in tokenize(text):
+            column = vocabulary.setdefault(token, len(vocabulary))
+            counts[column] = counts.get(column, 0) + 1
+        rows.append(counts)
+    tf = np.zeros((len(texts), max(len(vocabulary), 1)), dtype=np.float32)
+    for i, counts in enumerate(rows):
+        if counts:
+            tf[i, list(counts)] = list(counts.values())
+
+    df = (tf > 0).sum(axis=0)
+    idf = np.log(1 + (len(texts) - df + 0.5) / (df + 0.5)).astype(np.float32)
+    lengths = tf.sum(axis=1, keepdims=True)
+    norm = k1 * (1 - b + b * lengths / max(float(lengths.mean()), 1.0))
+    query_terms = np.zeros(tf.shape[1], dtype=np.float32)
+    for token in tokenize(query):
+        if token in vocabulary:
+            query_terms[vocabulary[token]] += 1
+    bm25 = (tf * (k1 + 1) / (tf + norm)) @ (idf * query_terms)
+
+    tfidf = tf * idf
+    tfidf /= np.maximum(np.linalg.norm(tfidf, axis=1, keepdims=True), 1e-9)
+    return bm25, tfidf
+
+
+def mmr_select(relevance: np.ndarray, similarity: np.ndarray, top_n: int, mmr_lambda: float, duplicate: float = 0.95) -> List[int]:
+    """
+    Maximal marginal relevance: greedily picks the candidate with the best relevance/novelty
+    trade-off. Candidates at least `duplicate` similar to a picked one are dropped outright.
+    """
+    selected = []
+    max_similarity = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    while len(selected) < top_n and available.any():
+        scores = np.where(available, mmr_lambda * relevance - (1 - mmr_lambda) * max_similarity, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        max_similarity = np.maximum(max_similarity, similarity[best])
+        available &= max_similarity < duplicate
+        available[best] = False
+    return selected
+
+
+class Reranker:
+    """
+    Picks the top_n of an over-fetched candidate list: candidates are scored in one
+    vectorized pass (BM25 over the candidate set, or a local cross-encoder in batches)
+    blended with their retrieval rank, then selected with MMR so overlapping chunks from
+    the splitter do not crowd out other evidence.
+    Re-ranking is skipped (retrieval order kept) when max_concurrent calls are already
+    running or recent calls exceeded budget_ms; a cross-encoder stops scoring at the budget.
+    """
+
+    def __init__(
+        self,
+        top_n: int = RERANK_TOP_N,
+        mmr_lambda: float = RERANK_MMR_LAMBDA,
+        budget_ms: float = RERANK_BUDGET_MS,
+        max_concurrent: int = RERANK_MAX_CONCURRENT,
+        model_name: str = RERANK_MODEL,
+    ):
+        self.top_n = top_n
+        self.mmr_lambda = mmr_lambda
+        self.budget_ms = budget_ms
+        self.max_concurrent = max_concurrent
+        self.model = self._load_model(model_name) if model_name else None
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._latency_ms = 0.0  # moving average
+        self.counts = {"reranked": 0, "skipped_load": 0, "skipped_latency": 0, "partial": 0}
+
+    @staticmethod
+    def _load_model(model_name: str):
+        try:
+            from sentence_transformers import CrossEncoder
+        except ImportError:
+            print("DEBUG: sentence-transformers is not installed, using the lexical re-ranker.")
+            return None
+        return CrossEncoder(model_name, device="cpu")
+
+    def _model_scores(self, query: str, texts: List[str], deadline: float) -> np.ndarray:
+        """Cross-encoder scores; candidates not reached before the deadline get NaN."""
+        scores = np.full(len(texts), np.nan, dtype=np.float32)
+        for start in range(0, len(texts), CROSS_ENCODER_BATCH_SIZE):
+            if start and time.perf_counter() > deadline:
+                break
+            batch = texts[start:start + CROSS_ENCODER_BATCH_SIZE]
+            scores[start:start + len(batch)] = self.model.predict([(query, text) for text in batch])
+        return scores
+
+    def _admit(self) -> Optional[str]:
+        with self._lock:
+            if self._in_flight >= self.max_concurrent:
+                self.counts["skipped_load"] += 1
+                return "skipped_load"
+            if self._latency_ms > self.budget_ms:
+                # Decay so re-ranking is retried once the pressure is gone
+                self._latency_ms *= 0.8
+                self.counts["skipped_latency"] += 1
+                return "skipped_latency"
+            self._in_flight += 1
+            return None
+
+    def rerank(self, query: str, docs: List[Document], report: Optional[dict] = None) -> List[Document]:
+        """
+        Returns up to top_n of docs (best first). report, if given, receives "outcome"
+        ("reranked", "partial", "skipped_load" or "skipped_latency") and "candidates".
+        """
+        report = report if report is not None else {}
+        report["candidates"] = len(docs)
+        if len(docs) <= 1:
+            report["outcome"] = "reranked"
+            return docs
+        skipped = self._admit()
+        if skipped is not None:
+            report["outcome"] = skipped
+            return docs[:self.top_n]
+        report["outcome"] = "reranked"
+        started = time.perf_counter()
+        try:
+            texts = [doc.page_content for doc in docs]
+            bm25, tfidf = _term_matrices(query, texts)
+            if self.model is not None:
+                scores = self._model_scores(query, texts, started + self.budget_ms / 1000)
+                scored = ~np.isnan(scores)
+                if not scored.all():
+                    report["outcome"] = "partial"
+                relevance = np.zeros(len(texts), dtype=np.float32)
+                relevance[scored] = _minmax(scores[scored])
+            else:
+                relevance = _minmax(bm25)
+            prior = 1.0 - np.arange(len(docs), dtype=np.float32) / len(docs)
+            relevance = (1 - PRIOR_WEIGHT) * relevance + PRIOR_WEIGHT * prior
+            selected = mmr_select(relevance, tfidf @ tfidf.T, self.top_n, self.mmr_lambda)
+            return [docs[i] for i in selected]
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            with self._lock:
+                self._in_flight -= 1
+                self._latency_ms = 0.8 * self._latency_ms + 0.2 * elapsed_ms
+                self.counts[report["outcome"]] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self.counts, "latency_ms": self._latency_ms, "model": self.model is not None}
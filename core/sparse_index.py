@@ -0,0 +1,142 @@
+import os
+import re
+import json
+import math
+import sqlite3
+import threading
+from typing import Iterable, List, Tuple
+
+SPARSE_INDEX_DIR = os.getenv("SPARSE_INDEX_DIR", ".cache")
+
+TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were will with".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lowercased word tokens plus adjacent-word bigrams, so exact references such as
+    "Table 4" or "Figure 15" match as a unit ("table_4") and not just as two common words.
+    """
+    words = TOKEN_RE.findall(text.lower())
+    tokens = [w for w in words if w not in STOPWORDS]
+    tokens.extend(f"{a}_{b}" for a, b in zip(words, words[1:]))
+    return tokens
+
+
+class SparseIndex:
+    """
+    Persistent BM25 index kept next to a Qdrant collection, stored as an inverted index
+    in SQLite. Unlike rank_bm25 (which rebuilds its whole corpus in memory) it can be
+    updated incrementally: chunks are added as they are uploaded and removed per source.
+    Documents share the Qdrant point IDs so results from both legs can be fused.
+    """
+
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "id TEXT PRIMARY KEY, source TEXT, length INTEGER NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS postings ("
+            "term TEXT NOT NULL, doc_id TEXT NOT NULL, tf INTEGER NOT NULL, PRIMARY KEY (term, doc_id))"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_postings_doc ON postings(doc_id)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_docs_source ON docs(source)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+        self._conn.commit()
+
+    def add(self, items: Iterable[Tuple[str, str, dict]]):
+        """Adds or replaces (point_id, text, metadata) entries."""
+        with self._lock:
+            for point_id, text, metadata in items:
+                tokens = tokenize(text)
+                counts = {}
+                for token in tokens:
+                    counts[token] = counts.get(token, 0) + 1
+                self._conn.execute("DELETE FROM postings WHERE doc_id = ?", (point_id,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO docs (id, source, length, text, metadata) VALUES (?, ?, ?, ?, ?)",
+                    (point_id, metadata.get("source"), len(tokens), text, json.dumps(metadata, default=str)),
+                )
+                self._conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, point_id, tf) for term, tf in counts.items()],
+                )
+            self._conn.commit()
+
+    def delete_source(self, source: str):
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM postings WHERE doc_id IN (SELECT id FROM docs WHERE source = ?)", (source,)
+            )
+            self._conn.execute("DELETE FROM docs WHERE source = ?", (source,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM postings")
+            self._conn.execute("DELETE FROM docs")
+            self._conn.commit()
+
+    def get_version(self) -> int:
+        """Content version of the collection, shared by every process using this index file."""
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()
+            return row[0] if row else 0
+
+    def bump_version(self) -> int:
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO meta (key, value) VALUES ('version', 1) "
+                "ON CONFLICT(key) DO UPDATE SET value = value + 1"
+            )
+            self._conn.commit()
+            return self._conn.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def count(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+
+    def search(self, query: str, k: int = 5) -> List[Tuple[str, float, str, dict]]:
+        """Returns the top k (point_id, score, text, metadata) by BM25."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        placeholders = ",".join("?" * len(terms))
+        with self._lock:
+            total_docs, avg_length = self._conn.execute("SELECT COUNT(*), AVG(length) FROM docs").fetchone()
+            if not total_docs:
+                return []
+            doc_freq = dict(self._conn.execute(
+                f"SELECT term, COUNT(*) FROM postings WHERE term IN ({placeholders}) GROUP BY term", terms
+            ).fetchall())
+            rows = self._conn.execute(
+                f"SELECT p.doc_id, p.term, p.tf, d.length FROM postings p JOIN docs d ON d.id = p.doc_id "
+                f"WHERE p.term IN ({placeholders})",
+                terms,
+            ).fetchall()
+            scores = {}
+            for doc_id, term, tf, length in rows:
+                df = doc_freq[term]
+                idf = math.log(1 + (total_docs - df + 0.5) / (df + 0.5))
+                norm = tf + self.k1 * (1 - self.b + self.b * length / (avg_length or 1))
+                scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (self.k1 + 1) / norm
+            top = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+            results = []
+            for doc_id, score in top:
+                text, metadata = self._conn.execute(
+                    "SELECT text, metadata FROM docs WHERE id = ?", (doc_id,)
+                ).fetchone()
+                results.append((doc_id, score, text, json.loads(metadata)))
+            return results
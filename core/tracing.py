@@ -0,0 +1,246 @@
+import os
+import json
+import time
+import uuid
+import threading
+from contextlib import contextmanager
+from typing import List, Optional
+
+# Comma-separated exporters for finished traces: "log", "prometheus", "otel" (empty = none)
+TRACE_SINKS = os.getenv("TRACE_SINKS", "")
+TRACE_LOG_PATH = os.getenv("TRACE_LOG_PATH", os.path.join(".cache", "traces.jsonl"))
+# Written (atomically) on every export, for the node_exporter textfile collector; empty = in-memory only
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "")
+
+
+class Span:
+    """One timed stage of a trace. Times are wall-clock seconds; duration uses perf_counter."""
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: dict):
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.name = name
+        self.attributes = attributes
+        self.start_time = time.time()
+        self.duration = 0.0
+        self.error = None
+        self._started = time.perf_counter()
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self._started
+
+    def end(self):
+        self.duration = self.elapsed()
+
+    def to_dict(self, trace_id: str) -> dict:
+        # Field names follow the OpenTelemetry span data model
+        return {
+            "trace_id": trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent_id,
+            "name": self.name,
+            "start_time_unix_nano": int(self.start_time * 1e9),
+            "end_time_unix_nano": int((self.start_time + self.duration) * 1e9),
+            "attributes": self.attributes,
+            "status": {"code": "ERROR", "message": self.error} if self.error else {"code": "OK"},
+        }
+
+
+class Trace:
+    """
+    Spans recorded for one question. Spans nest by the order they are opened, so
+    open them from the thread that owns the trace. finish() exports to the configured sinks.
+    """
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.root = Span(name, None, attributes)
+        self.spans: List[Span] = []
+        self._stack = [self.root]
+        self._finished = False
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        span = Span(name, self._stack[-1].span_id, attributes)
+        self.spans.append(span)
+        self._stack.append(span)
+        try:
+            yield span
+        except GeneratorExit:
+            span.set(cancelled=True)
+            raise
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            span.end()
+            self._stack.pop()
+
+    def set(self, **attributes):
+        self.root.set(**attributes)
+
+    def breakdown(self) -> dict:
+        """Milliseconds per stage name (summed over attempts), plus the total."""
+        timings = {}
+        for span in self.spans:
+            if span.name != "attempt":
+                timings[span.name] = timings.get(span.name, 0.0) + span.duration * 1000
+        timings["total"] = (self.root.duration if self._finished else self.root.elapsed()) * 1000
+        return timings
+
+    def finish(self, error: Optional[BaseException] = None):
+        if self._finished:
+            return
+        if error is not None:
+            self.root.error = f"{type(error).__name__}: {error}"
+        self.root.end()
+        self._finished = True
+        export_trace(self)
+
+    def to_dicts(self) -> List[dict]:
+        return [span.to_dict(self.trace_id) for span in [self.root] + self.spans]
+
+
+class LogSink:
+    """Appends every span as one JSON line (OpenTelemetry span fields) to path."""
+
+    def __init__(self, path: str = TRACE_LOG_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def export(self, trace: Trace):
+        lines = "".join(json.dumps(span, default=str) + "\n" for span in trace.to_dicts())
+        with self._lock, open(self.path, "a", encoding="utf-8") as f:
+            f.write(lines)
+
+
+class PrometheusSink:
+    """
+    Aggregates traces into Prometheus metrics: per-stage latency summaries and error
+    counts, request counts by outcome, and token counts. render() returns the text
+    exposition format; with a path it is also written to that file on every export.
+    """
+
+    def __init__(self, path: str = PROMETHEUS_TEXTFILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self.stage_seconds = {}  # stage -> [count, sum]
+        self.stage_errors = {}
+        self.requests = {}
+        self.tokens = {}
+
+    def export(self, trace: Trace):
+        with self._lock:
+            for span in [trace.root] + trace.spans:
+                name = trace.root.name if span is trace.root else span.name
+                stats = self.stage_seconds.setdefault(name, [0, 0.0])
+                stats[0] += 1
+                stats[1] += span.duration
+                if span.error:
+                    self.stage_errors[name] = self.stage_errors.get(name, 0) + 1
+                for kind in ("prompt_tokens", "completion_tokens"):
+                    if kind in span.attributes:
+                        self.tokens[kind] = self.tokens.get(kind, 0) + span.attributes[kind]
+            outcome = "error" if trace.root.error else ("cached" if trace.root.attributes.get("cached") else "answered")
+            self.requests[outcome] = self.requests.get(outcome, 0) + 1
+            text = self.render()
+        if self.path:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+
+    def render(self) -> str:
+        lines = [
+            "# HELP rag_stage_seconds Time spent in each stage of the question path.",
+            "# TYPE rag_stage_seconds summary",
+        ]
+        for stage, (count, total) in sorted(self.stage_seconds.items()):
+            lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {total:.6f}')
+            lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {count}')
+        lines += ["# HELP rag_stage_errors_total Stage failures (including retried attempts).", "# TYPE rag_stage_errors_total counter"]
+        for stage, count in sorted(self.stage_errors.items()):
+            lines.append(f'rag_stage_errors_total{{stage="{stage}"}} {count}')
+        lines += ["# HELP rag_requests_total Questions by outcome.", "# TYPE rag_requests_total counter"]
+        for outcome, count in sorted(self.requests.items()):
+            lines.append(f'rag_requests_total{{outcome="{outcome}"}} {count}')
+        lines += ["# HELP rag_tokens_total Estimated LLM tokens.", "# TYPE rag_tokens_total counter"]
+        for kind, count in sorted(self.tokens.items()):
+            lines.append(f'rag_tokens_total{{kind="{kind}"}} {count}')
+        return "\n".join(lines) + "\n"
+
+
+class OpenTelemetrySink:
+    """Re-emits finished traces through the OpenTelemetry API (requires opentelemetry-api)."""
+
+    def __init__(self, tracer=None):
+        from opentelemetry import trace as otel_trace
+        from opentelemetry.trace import Status, StatusCode
+
+        self._otel_trace = otel_trace
+        self._status = (Status, StatusCode)
+        self.tracer = tracer or otel_trace.get_tracer("rag_streamlit_app")
+
+    def export(self, trace: Trace):
+        Status, StatusCode = self._status
+        otel_spans = {}
+        for span in [trace.root] + trace.spans:
+            parent = otel_spans.get(span.parent_id)
+            context = self._otel_trace.set_span_in_context(parent) if parent is not None else None
+            otel_span = self.tracer.start_span(
+                span.name,
+                context=context,
+                start_time=int(span.start_time * 1e9),
+                attributes={k: v for k, v in span.attributes.items() if isinstance(v, (str, bool, int, float))},
+            )
+            if span.error:
+                otel_span.set_status(Status(StatusCode.ERROR, span.error))
+            otel_spans[span.span_id] = otel_span
+        # End children before parents
+        for span in reversed([trace.root] + trace.spans):
+            otel_spans[span.span_id].end(end_time=int((span.start_time + span.duration) * 1e9))
+
+
+_sinks = None
+_sinks_lock = threading.Lock()
+
+SINK_FACTORIES = {
+    "log": LogSink,
+    "prometheus": PrometheusSink,
+    "otel": OpenTelemetrySink,
+}
+
+
+def get_sinks() -> list:
+    """Sinks configured by TRACE_SINKS (built on first use) plus any added with add_sink."""
+    global _sinks
+    with _sinks_lock:
+        if _sinks is None:
+            _sinks = []
+            for name in filter(None, (n.strip().lower() for n in TRACE_SINKS.split(","))):
+                try:
+                    _sinks.append(SINK_FACTORIES[name]())
+                except Exception as e:
+                    print(f"DEBUG: Trace sink '{name}' disabled: {str(e)}")
+        return list(_sinks)
+
+
+def add_sink(sink):
+    """Registers an object with an export(trace) method."""
+    get_sinks()
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def export_trace(trace: Trace):
+    for sink in get_sinks():
+        try:
+            sink.export(trace)
+        except Exception as e:
+            print(f"DEBUG: Trace export to {type(sink).__name__} failed: {str(e)}")
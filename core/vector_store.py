@@ -1,12 +1,20 @@
 import os
 import uuid
+import time
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from qdrant_client import QdrantClient
 from qdrant_client.http import models
-from typing import List, Optional
+from typing import Iterable, List, Optional
 from langchain_core.documents import Document
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_qdrant import QdrantVectorStore
+from core.embedding_cache import CachedEmbeddings, EmbeddingCache, EMBEDDING_CACHE_PATH
+from core.embedding_scheduler import EmbeddingScheduler
+from core.sparse_index import SparseIndex, SPARSE_INDEX_DIR
+from core.collection_profiles import get_collection_profile, TruncatedEmbeddings
 
 # Load environment variables
 load_dotenv()
@@ -14,92 +22,460 @@ load_dotenv()
 QDRANT_URL = os.getenv("QDRANT_URL")
 QDRANT_API_KEY = os.getenv("QDRANT_API_KEY")
 COLLECTION_NAME = os.getenv("QDRANT_COLLECTION_NAME", "knowledge_base")
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+UPLOAD_BATCH_SIZE = int(os.getenv("QDRANT_UPLOAD_BATCH_SIZE", "128"))
+POINT_ID_NAMESPACE = uuid.UUID("6f1c1a52-3b0e-4c55-9a8e-2f3d7c1b9e40")
 
-def get_embeddings_model():
-    """Returns the Google Generative AI embeddings model."""
+# Process-wide resource registry. Streamlit re-executes app.py on every
+# interaction, so clients are kept here (keyed by their config) instead of
+# being rebuilt per question. Shared by all sessions of the same process.
+# Factories run outside _RESOURCES_LOCK (they may build other resources, and some
+# are slow), under a per-key lock so each resource is still built only once.
+_RESOURCES = {}
+_RESOURCE_STATS = {}
+_BUILD_LOCKS = {}
+_RESOURCES_LOCK = threading.Lock()
+
+def get_cached_resource(kind: str, key: tuple, factory):
+    """Returns the resource stored under (kind, key), building it once with factory()."""
+    cache_key = (kind,) + tuple(key)
+    with _RESOURCES_LOCK:
+        stats = _RESOURCE_STATS.setdefault(kind, {"builds": 0, "hits": 0})
+        if cache_key in _RESOURCES:
+            stats["hits"] += 1
+            return _RESOURCES[cache_key]
+        build_lock = _BUILD_LOCKS.setdefault(cache_key, threading.Lock())
+    with build_lock:
+        # Another thread may have built it while we waited
+        with _RESOURCES_LOCK:
+            if cache_key in _RESOURCES:
+                stats["hits"] += 1
+                return _RESOURCES[cache_key]
+        try:
+            resource = factory()
+            with _RESOURCES_LOCK:
+                _RESOURCES[cache_key] = resource
+                stats["builds"] += 1
+        finally:
+            with _RESOURCES_LOCK:
+                _BUILD_LOCKS.pop(cache_key, None)
+    print(f"DEBUG: Built {kind} resource (cold start).")
+    return resource
+
+def get_resource_status() -> dict:
+    """Reports which shared resources are warm and how often they were reused."""
+    with _RESOURCES_LOCK:
+        status = {}
+        for kind, stats in _RESOURCE_STATS.items():
+            count = sum(1 for k in _RESOURCES if k[0] == kind)
+            status[kind] = {
+                "warm": count > 0,
+                "instances": count,
+                "builds": stats["builds"],
+                "hits": stats["hits"],
+            }
+        return status
+
+def clear_resource_cache(kind: Optional[str] = None):
+    """Drops cached resources (all of them, or only one kind) so they are rebuilt on next use."""
+    with _RESOURCES_LOCK:
+        for cache_key in list(_RESOURCES):
+            if kind is None or cache_key[0] == kind:
+                del _RESOURCES[cache_key]
+
+def get_collection_version(collection_name: str = COLLECTION_NAME) -> int:
+    """
+    Counter bumped whenever the collection's content changes (used to scope answer caches).
+    Stored in the collection's sparse-index file and read on every call, so ingests from
+    ingest.py or another worker invalidate this process's cached answers too.
+    """
+    return get_sparse_index(collection_name).get_version()
+
+def bump_collection_version(collection_name: str = COLLECTION_NAME):
+    get_sparse_index(collection_name).bump_version()
+
+def get_embedding_cache():
+    """Returns the shared on-disk embedding cache."""
+    return get_cached_resource(
+        "embedding_cache",
+        (EMBEDDING_CACHE_PATH,),
+        lambda: EmbeddingCache(EMBEDDING_CACHE_PATH),
+    )
+
+def get_embeddings_model(model: str = EMBEDDING_MODEL):
+    """Returns the shared Google Generative AI embeddings model, wrapped in the embedding cache."""
     api_key = os.getenv("GOOGLE_API_KEY")
-    return GoogleGenerativeAIEmbeddings(
-        model="models/gemini-embedding-001",
-        google_api_key=api_key
+    return get_cached_resource(
+        "embeddings",
+        (model, api_key),
+        lambda: CachedEmbeddings(
+            GoogleGenerativeAIEmbeddings(model=model, google_api_key=api_key),
+            model_name=model,
+            cache=get_embedding_cache(),
+        ),
+    )
+
+def get_embedding_scheduler():
+    """Returns the shared batch scheduler used for ingest-time embedding."""
+    embeddings = get_embeddings_model()
+    return get_cached_resource(
+        "embedding_scheduler",
+        (EMBEDDING_MODEL,),
+        lambda: EmbeddingScheduler(embeddings),
     )
 
 def get_qdrant_client():
-    """Initializes and returns a QdrantClient."""
-    return QdrantClient(
-        url=QDRANT_URL,
-        api_key=QDRANT_API_KEY,
-        timeout=120.0,
-        prefer_grpc=False
+    """Returns the shared QdrantClient (one HTTP connection pool per URL)."""
+    return get_cached_resource(
+        "qdrant_client",
+        (QDRANT_URL, QDRANT_API_KEY),
+        lambda: QdrantClient(
+            url=QDRANT_URL,
+            api_key=QDRANT_API_KEY,
+            timeout=120.0,
+            prefer_grpc=False
+        ),
     )
 
-def create_vector_store(documents: List[Document], persist_directory: str = None):
-    """Creates a Qdrant collection using raw client to bypass Pydantic V1/Python 3.14 issues."""
-    print("DEBUG: Starting create_vector_store (Raw Client Implementation)...")
-    try:
-        embeddings_model = get_embeddings_model()
-        client = get_qdrant_client()
-        
-        # 1. Generate Embeddings first to determine dimension
-        print(f"DEBUG: Embedding {len(documents)} documents to determine dimension...")
-        texts = [doc.page_content for doc in documents]
-        embeddings = embeddings_model.embed_documents(texts)
-        
-        if not embeddings:
-            raise ValueError("No embeddings were generated.")
-            
-        vector_dim = len(embeddings[0])
-        print(f"DEBUG: Detected vector dimension: {vector_dim}")
-        
-        # 2. Manage Collection
-        collections = client.get_collections().collections
-        if any(c.name == COLLECTION_NAME for c in collections):
-            print(f"DEBUG: Deleting existing collection '{COLLECTION_NAME}'...")
-            client.delete_collection(COLLECTION_NAME)
-        
-        print(f"DEBUG: Creating collection '{COLLECTION_NAME}' with dimension {vector_dim}...")
-        client.create_collection(
-            collection_name=COLLECTION_NAME,
-            vectors_config=models.VectorParams(size=vector_dim, distance=models.Distance.COSINE),
+def get_sparse_index(collection_name: str = COLLECTION_NAME):
+    """Returns the shared BM25 index that mirrors the given collection."""
+    path = os.path.join(SPARSE_INDEX_DIR, f"sparse_{collection_name}.sqlite")
+    return get_cached_resource("sparse_index", (path,), lambda: SparseIndex(path))
+
+def rebuild_sparse_index(collection_name: str = COLLECTION_NAME, batch_size: int = 256) -> int:
+    """
+    Rebuilds the BM25 index from the points stored in Qdrant, e.g. on a fresh
+    deployment whose local disk lost the index. Returns the number of chunks indexed.
+    """
+    client = get_qdrant_client()
+    sparse_index = get_sparse_index(collection_name)
+    sparse_index.clear()
+    if not collection_exists(client, collection_name):
+        return 0
+    total = 0
+    offset = None
+    while True:
+        records, offset = client.scroll(
+            collection_name=collection_name,
+            limit=batch_size,
+            offset=offset,
+            with_payload=True,
+            with_vectors=False,
         )
-        
-        # 3. Upload to Qdrant using raw client
-        print("DEBUG: Uploading vectors to Qdrant Cloud...")
-        points = []
-        for i, (text, vector, doc) in enumerate(zip(texts, embeddings, documents)):
-            payload = doc.metadata.copy()
-            payload["page_content"] = text
-            points.append(models.PointStruct(
-                id=str(uuid.uuid4()),
-                vector=vector,
-                payload=payload
-            ))
-        
-        # Batch upload
-        client.upsert(
-            collection_name=COLLECTION_NAME,
-            points=points
+        sparse_index.add(
+            (str(r.id), r.payload.get("page_content", ""), {k: v for k, v in r.payload.items() if k != "page_content"})
+            for r in records
         )
-        print("DEBUG: Raw upload successful!")
-        
-        # Return a QdrantVectorStore instance for the app to use
-        return QdrantVectorStore(
-            client=client,
-            collection_name=COLLECTION_NAME,
-            embedding=embeddings_model,
+        total += len(records)
+        if offset is None:
+            break
+    print(f"DEBUG: Rebuilt sparse index for '{collection_name}' ({total} chunks).")
+    return total
+
+def point_id_for(text: str, metadata: dict) -> str:
+    """Deterministic point ID derived from the chunk's source and content."""
+    digest = hashlib.sha256(f"{metadata.get('source', '')}\n{text}".encode("utf-8")).hexdigest()
+    return str(uuid.uuid5(POINT_ID_NAMESPACE, digest))
+
+def collection_exists(client, collection_name: str = COLLECTION_NAME) -> bool:
+    collections = client.get_collections().collections
+    return any(c.name == collection_name for c in collections)
+
+def ensure_collection(client, vector_dim: int, collection_name: str = COLLECTION_NAME, profile=None):
+    """
+    Creates the collection (and its `source` payload index) with the collection profile's
+    vector, HNSW and quantization settings if it is missing; an existing collection is
+    brought in line with the profile (see apply_collection_profile).
+    """
+    profile = profile or get_collection_profile()
+    if collection_exists(client, collection_name):
+        apply_collection_profile(client, vector_dim, collection_name, profile)
+        return False
+    print(f"DEBUG: Creating collection '{collection_name}' with dimension {vector_dim} (profile '{profile.name}')...")
+    client.create_collection(
+        collection_name=collection_name,
+        vectors_config=profile.vectors_config(vector_dim),
+        hnsw_config=profile.hnsw_config(),
+        quantization_config=profile.quantization_config(),
+    )
+    client.create_payload_index(
+        collection_name=collection_name,
+        field_name="source",
+        field_schema=models.PayloadSchemaType.KEYWORD,
+    )
+    return True
+
+def apply_collection_profile(client, vector_dim: int, collection_name: str = COLLECTION_NAME, profile=None) -> bool:
+    """
+    Updates on-disk storage, HNSW and quantization settings of an existing collection when
+    they differ from the profile (Qdrant rebuilds the affected segments in the background).
+    The vector size cannot change in place: a mismatch requires a full re-ingest.
+    Returns True if the collection was updated.
+    """
+    profile = profile or get_collection_profile()
+    config = client.get_collection(collection_name).config
+    params = config.params.vectors
+    if params.size != vector_dim:
+        raise ValueError(
+            f"Collection '{collection_name}' stores {params.size}-dim vectors but profile '{profile.name}' "
+            f"produces {vector_dim}; re-ingest with incremental=False to rebuild it."
         )
+    hnsw = profile.hnsw_config()
+    wanted_hnsw = (hnsw.m or config.hnsw_config.m, hnsw.ef_construct or config.hnsw_config.ef_construct, bool(hnsw.on_disk))
+    current_hnsw = (config.hnsw_config.m, config.hnsw_config.ef_construct, bool(config.hnsw_config.on_disk))
+    current_quantization = config.quantization_config
+    quantization = profile.quantization_config()
+    if (
+        bool(params.on_disk) == profile.on_disk
+        and wanted_hnsw == current_hnsw
+        and type(current_quantization) is type(quantization)
+    ):
+        return False
+    print(f"DEBUG: Applying collection profile '{profile.name}' to '{collection_name}'...")
+    client.update_collection(
+        collection_name=collection_name,
+        vectors_config={"": models.VectorParamsDiff(on_disk=profile.on_disk, hnsw_config=hnsw)},
+        hnsw_config=hnsw,
+        quantization_config=quantization if quantization is not None else models.Disabled.DISABLED,
+    )
+    return True
+
+def get_existing_point_ids(client, ids: List[str], collection_name: str = COLLECTION_NAME, batch_size: int = 256) -> set:
+    """Returns the subset of ids that are already stored in the collection."""
+    existing = set()
+    for i in range(0, len(ids), batch_size):
+        records = client.retrieve(
+            collection_name=collection_name,
+            ids=ids[i:i + batch_size],
+            with_payload=False,
+            with_vectors=False,
+        )
+        existing.update(str(r.id) for r in records)
+    return existing
+
+def delete_source(source: str, collection_name: str = COLLECTION_NAME):
+    """Deletes every point whose payload `source` equals the given file name (dense and sparse)."""
+    client = get_qdrant_client()
+    get_sparse_index(collection_name).delete_source(source)
+    if collection_exists(client, collection_name):
+        print(f"DEBUG: Deleting all points for source '{source}'...")
+        client.delete(
+            collection_name=collection_name,
+            points_selector=models.FilterSelector(
+                filter=models.Filter(
+                    must=[models.FieldCondition(key="source", match=models.MatchValue(value=source))]
+                )
+            ),
+        )
+    # Only once the points are gone, so cached answers are not re-keyed to stale content
+    bump_collection_version(collection_name)
+
+def _batched(iterable: Iterable, size: int):
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def iter_embedded_chunks(client, documents: Iterable[Document], incremental: bool = True, progress_callback=None, counts: Optional[dict] = None, batch_size: Optional[int] = None):
+    """
+    Yields (point_id, text, vector, metadata) for chunks that still need indexing,
+    pulling and embedding one group of documents at a time. The default group size
+    keeps every scheduler worker busy with one batch.
+    """
+    scheduler = get_embedding_scheduler()
+    profile = get_collection_profile()
+    batch_size = batch_size or scheduler.batch_size * scheduler.max_workers
+    counts = counts if counts is not None else {}
+    counts.setdefault("chunks", 0)
+    counts.setdefault("skipped", 0)
+    total = len(documents) if hasattr(documents, "__len__") else None
+    seen = set()
+    collection_known = False
+    for group in _batched(documents, batch_size):
+        counts["chunks"] += len(group)
+        # Duplicate chunks within the run collapse to one point
+        pending = {}
+        for doc in group:
+            point_id = point_id_for(doc.page_content, doc.metadata)
+            if point_id not in seen:
+                seen.add(point_id)
+                pending[point_id] = doc
+        counts["skipped"] += len(group) - len(pending)
+
+        # Skip chunks already present in the collection
+        if incremental and pending:
+            collection_known = collection_known or collection_exists(client)
+            if collection_known:
+                existing = get_existing_point_ids(client, list(pending))
+                for point_id in existing:
+                    pending.pop(point_id, None)
+                counts["skipped"] += len(existing)
+
+        if pending:
+            ids = list(pending)
+            texts = [pending[point_id].page_content for point_id in ids]
+            embed_started = time.time()
+            vectors = scheduler.embed(texts)
+            counts["embed_seconds"] = counts.get("embed_seconds", 0.0) + time.time() - embed_started
+            for point_id, text, vector in zip(ids, texts, vectors):
+                yield point_id, text, profile.truncate(vector), pending[point_id].metadata
+        if progress_callback:
+            progress_callback(counts["chunks"], total)
+
+def _upsert_with_retry(client, points, collection_name: str, max_retries: int = 3):
+    for attempt in range(max_retries + 1):
+        try:
+            client.upsert(collection_name=collection_name, points=points)
+            return
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            wait = 2 ** attempt
+            print(f"DEBUG: Upsert of {len(points)} points failed ({e}), retrying in {wait}s...")
+            time.sleep(wait)
+
+def _store_batch(client, points, collection_name: str, sparse_index=None) -> float:
+    """Upserts one batch and, once Qdrant accepted it, adds it to the sparse (BM25) index. Returns the upsert time."""
+    started = time.time()
+    _upsert_with_retry(client, points, collection_name)
+    upsert_seconds = time.time() - started
+    if sparse_index is not None:
+        sparse_index.add(
+            (str(p.id), p.payload["page_content"], {k: v for k, v in p.payload.items() if k != "page_content"})
+            for p in points
+        )
+    return upsert_seconds
+
+def _point_bytes(point: models.PointStruct) -> int:
+    """Size of one point in the JSON upsert request (vectors go over REST as decimal text, not float32)."""
+    return len(point.model_dump_json(exclude_none=True))
+
+def upload_points(client, items, collection_name: str = COLLECTION_NAME, batch_size: int = UPLOAD_BATCH_SIZE, max_in_flight: int = 2, sparse_index=None) -> dict:
+    """
+    Consumes an iterator of (point_id, text, vector, metadata) and upserts it in bounded batches.
+    Uploads run on a background thread while the iterator produces (embeds) the next batch;
+    at most max_in_flight batches are held in memory. Each failed batch is retried on its own.
+    Uploaded batches are also added to sparse_index when one is given.
+    """
+    started = time.time()
+    uploaded = 0
+    uploaded_bytes = 0
+    upsert_seconds = 0.0
+    collection_ready = False
+    in_flight = []
+    batch = []
+    batch_bytes = 0
+
+    def wait_oldest():
+        nonlocal uploaded, uploaded_bytes, upsert_seconds
+        future, size, size_bytes = in_flight.pop(0)
+        upsert_seconds += future.result()
+        uploaded += size
+        uploaded_bytes += size_bytes
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for point_id, text, vector, metadata in items:
+            if not collection_ready:
+                print(f"DEBUG: Detected vector dimension: {len(vector)}")
+                ensure_collection(client, len(vector), collection_name)
+                collection_ready = True
+            payload = dict(metadata)
+            payload["page_content"] = text
+            point = models.PointStruct(id=point_id, vector=vector, payload=payload)
+            batch.append(point)
+            batch_bytes += _point_bytes(point)
+            if len(batch) >= batch_size:
+                if len(in_flight) >= max_in_flight:
+                    wait_oldest()
+                in_flight.append((executor.submit(_store_batch, client, batch, collection_name, sparse_index), len(batch), batch_bytes))
+                batch = []
+                batch_bytes = 0
+        if batch:
+            in_flight.append((executor.submit(_store_batch, client, batch, collection_name, sparse_index), len(batch), batch_bytes))
+        while in_flight:
+            wait_oldest()
+
+    elapsed = time.time() - started
+    return {
+        "points": uploaded,
+        "seconds": elapsed,
+        "points_per_sec": uploaded / elapsed if elapsed else 0.0,
+        "bytes_uploaded": uploaded_bytes,
+        "upload_seconds": upsert_seconds,
+    }
+
+def index_documents(documents: Iterable[Document], incremental: bool = True, progress_callback=None) -> dict:
+    """
+    Indexes documents (a list or any iterator of chunks) into Qdrant using the raw client.
+    In incremental mode the collection is kept, points get content-hash IDs and chunks that
+    are already stored are not re-embedded. incremental=False drops and rebuilds the collection.
+    Embedding and upload are streamed group by group, so memory stays flat with corpus size.
+    progress_callback(done, total) is called after each group; total is None for iterators.
+    New chunks are also added to the collection's sparse (BM25) index.
+    Returns upload stats (points, skipped, chunks, seconds, points_per_sec, bytes_uploaded,
+    upload_seconds, embed_seconds, embedding_calls/texts/chars).
+    """
+    client = get_qdrant_client()
+    sparse_index = get_sparse_index()
+    if not incremental and collection_exists(client):
+        print(f"DEBUG: Deleting existing collection '{COLLECTION_NAME}'...")
+        client.delete_collection(COLLECTION_NAME)
+        sparse_index.clear()
+
+    counts = {}
+    embeddings = get_embeddings_model()
+    usage_before = embeddings.api_usage()
+    items = iter_embedded_chunks(client, documents, incremental, progress_callback, counts)
+    stats = upload_points(client, items, sparse_index=sparse_index)
+    stats.update(counts)
+    stats.setdefault("embed_seconds", 0.0)
+    usage = embeddings.api_usage()
+    # Process-wide counters: concurrent ingests in the same process are attributed to each other
+    stats["embedding_calls"] = usage["calls"] - usage_before["calls"]
+    stats["embedding_texts"] = usage["texts"] - usage_before["texts"]
+    stats["embedding_chars"] = usage["chars"] - usage_before["chars"]
+    if stats["points"] or not incremental:
+        bump_collection_version()
+    print(f"DEBUG: Indexed {stats['points']} new chunks, skipped {stats['skipped']} ({stats['points_per_sec']:.1f} points/sec).")
+    return stats
+
+def create_vector_store(documents: List[Document], persist_directory: str = None, incremental: bool = True, progress_callback=None):
+    """Indexes documents (see index_documents) and returns the shared vector store. Bypasses Pydantic V1/Python 3.14 issues."""
+    print(f"DEBUG: Starting create_vector_store (incremental={incremental})...")
+    try:
+        stats = index_documents(documents, incremental=incremental, progress_callback=progress_callback)
+        if not stats["points"] and not stats["skipped"]:
+            raise ValueError("No embeddings were generated.")
+
+        # Return the shared QdrantVectorStore instance for the app to use
+        return load_vector_store()
     except Exception as e:
         import traceback
         print(f"DEBUG: Error in create_vector_store:\n{traceback.format_exc()}")
         raise e
 
 def load_vector_store(persist_directory: str = None):
-    """Loads an existing Qdrant vector store."""
+    """
+    Loads the shared Qdrant vector store for the configured collection. Query vectors are
+    truncated to match the collection profile.
+    """
     embeddings = get_embeddings_model()
     client = get_qdrant_client()
-    return QdrantVectorStore(
-        client=client,
-        collection_name=COLLECTION_NAME,
-        embedding=embeddings,
+    profile = get_collection_profile()
+    if profile.dimensions:
+        embeddings = TruncatedEmbeddings(embeddings, profile)
+    return get_cached_resource(
+        "vector_store",
+        (QDRANT_URL, COLLECTION_NAME, EMBEDDING_MODEL, profile.dimensions),
+        lambda: QdrantVectorStore(
+            client=client,
+            collection_name=COLLECTION_NAME,
+            embedding=embeddings,
+        ),
     )
 
 def similarity_search(vector_store, query: str, k: int = 3):
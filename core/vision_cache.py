@@ -0,0 +1,122 @@
+import os
+import time
+import sqlite3
+import hashlib
+import threading
+from typing import Optional
+from PIL import Image
+
+VISION_CACHE_PATH = os.getenv("VISION_CACHE_PATH", os.path.join(".cache", "vision.sqlite"))
+VISION_CACHE_MAX_ENTRIES = int(os.getenv("VISION_CACHE_MAX_ENTRIES", "5000"))
+# Max Hamming distance (out of 64 bits) for two renders to count as the same page.
+# Must stay <= 3 so the four 16-bit bands below are guaranteed to find every match.
+VISION_CACHE_MAX_DISTANCE = min(3, int(os.getenv("VISION_CACHE_MAX_DISTANCE", "3")))
+
+
+def perceptual_hash(image: Image.Image) -> int:
+    """64-bit difference hash (dHash): robust to re-rendering, compression and small edits."""
+    small = image.convert("L").resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            left = pixels[row * 9 + col]
+            right = pixels[row * 9 + col + 1]
+            value = (value << 1) | (1 if left > right else 0)
+    return value
+
+
+def _bands(phash: int):
+    return [(phash >> shift) & 0xFFFF for shift in (48, 32, 16, 0)]
+
+
+def _signed(value: int) -> int:
+    """SQLite integers are signed 64-bit."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+class VisionCache:
+    """
+    Persistent SQLite store of vision-model descriptions keyed by the perceptual hash of
+    the rendered page plus the model and prompt. Lookups match near-identical pages
+    (Hamming distance <= max_distance); least recently used rows are evicted.
+    """
+
+    def __init__(self, path: str = VISION_CACHE_PATH, max_entries: int = VISION_CACHE_MAX_ENTRIES, max_distance: int = VISION_CACHE_MAX_DISTANCE):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS descriptions ("
+            "id INTEGER PRIMARY KEY, scope TEXT NOT NULL, phash INTEGER NOT NULL, "
+            "b0 INTEGER, b1 INTEGER, b2 INTEGER, b3 INTEGER, "
+            "description TEXT NOT NULL, last_access REAL NOT NULL, "
+            "UNIQUE(scope, phash))"
+        )
+        for band in ("b0", "b1", "b2", "b3"):
+            self._conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{band} ON descriptions(scope, {band})")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_vision_last_access ON descriptions(last_access)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_scope(model: str, prompt: str) -> str:
+        return f"{model}|{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]}"
+
+    def get(self, scope: str, phash: int) -> Optional[str]:
+        """Returns the description of the closest cached page within max_distance, if any."""
+        b0, b1, b2, b3 = _bands(phash)
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT id, phash, description FROM descriptions "
+                "WHERE scope = ? AND (b0 = ? OR b1 = ? OR b2 = ? OR b3 = ?)",
+                (scope, b0, b1, b2, b3),
+            ).fetchall()
+            best = None
+            for row_id, stored, description in rows:
+                distance = bin((stored & 0xFFFFFFFFFFFFFFFF) ^ phash).count("1")
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, row_id, description)
+            if best is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._conn.execute("UPDATE descriptions SET last_access = ? WHERE id = ?", (time.time(), best[1]))
+            self._conn.commit()
+            return best[2]
+
+    def put(self, scope: str, phash: int, description: str):
+        b0, b1, b2, b3 = _bands(phash)
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO descriptions (scope, phash, b0, b1, b2, b3, description, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (scope, _signed(phash), b0, b1, b2, b3, description, time.time()),
+            )
+            count = self._conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+            if count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM descriptions WHERE id IN "
+                    "(SELECT id FROM descriptions ORDER BY last_access ASC LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        with self._lock:
+            size = self._conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": size,
+            "max_entries": self.max_entries,
+        }
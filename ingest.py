@@ -1,6 +1,7 @@
 from core.loader import load_pdf
 from core.splitter import split_documents
 import os
+import sys
 
 def test_ingestion():
     sample_file = "artificial.pdf"
@@ -24,5 +25,31 @@ def test_ingestion():
         print("-" * 30)
         print(f"Character count: {len(chunks[0].page_content)}")
 
+def ingest_files(paths):
+    """Indexes PDFs into Qdrant through the streaming ingestion pipeline."""
+    from core.ingestion import run_ingestion
+
+    files = [(path, os.path.basename(path)) for path in paths if os.path.exists(path)]
+    if not files:
+        print("❌ Error: none of the given files exist.")
+        return
+
+    def on_event(event, info):
+        if event == "file_extracted":
+            print(f"📖 Extracted {info['filename']} ({info['index'] + 1}/{info['total']}), analyzing visuals...")
+        elif event == "file_failed":
+            print(f"❌ {info['filename']}: {info['error']}")
+        elif event == "chunks_indexed":
+            print(f"💾 {info['chunks']} chunks processed ({info['progress']:.0%})...")
+
+    stats = run_ingestion(files, progress_callback=on_event)
+    print(f"✅ Indexed {stats['points']} new chunks, skipped {stats['skipped']} already stored.")
+    report = stats["report"]
+    print(f"📊 {report['pages_per_sec']:.1f} pages/sec, {report['bytes_uploaded'] / 1e6:.1f} MB uploaded, "
+          f"~${report['estimated_cost']['total_usd']:.4f} estimated. Report: {stats['report_path']}")
+
 if __name__ == "__main__":
-    test_ingestion()
+    if len(sys.argv) > 1:
+        ingest_files(sys.argv[1:])
+    else:
+        test_ingestion()
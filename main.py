@@ -1,42 +1,50 @@
 import os
-from core.rag_chain import get_rag_chain_with_sources
+from core.rag_chain import get_streaming_rag_chain_with_memory_and_sources
+from langchain_core.messages import HumanMessage, AIMessage
 from dotenv import load_dotenv
 
 def main():
     load_dotenv()
-    
-    persist_dir = "faiss_db"
-    if not os.path.exists(persist_dir):
-        print(f"❌ Error: Vector store not found in '{persist_dir}'. Please run Task 3 first.")
+
+    if not os.getenv("QDRANT_URL"):
+        print("❌ Error: Qdrant is not configured. Please set QDRANT_URL and QDRANT_API_KEY in .env")
         return
 
     print("🤖 AI Knowledge Assistant (RAG) is ready!")
     print("Type 'exit' to quit.")
-    
-    rag_chain = get_rag_chain_with_sources(persist_dir)
+
+    rag_chain = get_streaming_rag_chain_with_memory_and_sources()
+    chat_history = []
 
     while True:
         query = input("\n❓ Question: ")
-        
+
         if query.lower() in ["exit", "quit"]:
             break
-            
+
         if not query.strip():
             continue
 
         print("🧠 Thinking...")
         try:
-            result = rag_chain(query)
-            
-            print("\n💡 Answer:")
+            result = {}
+            for event in rag_chain({"chat_history": chat_history, "question": query}):
+                if event["type"] == "sources":
+                    print("\n💡 Answer:")
+                    print("-" * 50)
+                elif event["type"] == "token":
+                    print(event["text"], end="", flush=True)
+                elif event["type"] == "done":
+                    result = event
+            print()
             print("-" * 50)
-            print(result["answer"])
-            print("-" * 50)
-            
+
             # Show unique sources
             sources = set(result["sources"])
             print(f"📚 Sources: {', '.join(sources)}")
-            
+
+            chat_history.extend([HumanMessage(content=query), AIMessage(content=result["answer"])])
+
         except Exception as e:
             print(f"❌ An error occurred: {str(e)}")
 